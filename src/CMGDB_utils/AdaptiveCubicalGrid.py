@@ -0,0 +1,169 @@
+### AdaptiveCubicalGrid.py
+### MIT LICENSE 2026 Marcio Gameiro
+
+import CMGDB_utils
+
+import numpy as np
+import itertools
+
+class AdaptiveCubicalGrid:
+    """Cubical grid with cubes of different resolutions. The cubes (leaves) at level l are
+       cubes of the uniform grid with grid_size * 2^l cubes. Initially the leaves are the
+       cubes of the grid at level 0 and each subdivision replaces a leaf by its 2^dim
+       children at the next level. The leaves are indexed by 0, 1, ..., size() - 1."""
+
+    def __init__(self, lower_bounds, upper_bounds, grid_size):
+        self.lower_bounds = lower_bounds
+        self.upper_bounds = upper_bounds
+        self.grid_size = grid_size
+        self.dim = len(self.lower_bounds)
+        # Uniform grids at each level
+        self.grids = [CMGDB_utils.CubicalGrid(lower_bounds, upper_bounds, grid_size)]
+        # Level and index (in the grid of its level) of each leaf
+        num_cubes = int(self.grids[0].size())
+        self.leaf_levels = np.zeros(num_cubes, dtype=np.int64)
+        self.leaf_indices = np.arange(num_cubes, dtype=np.int64)
+        self.update_level_leaves()
+
+    def update_level_leaves(self):
+        """Compute the sorted grid indices of the leaves at each level"""
+        self.level_leaves = []
+        for level in range(len(self.grids)):
+            leaves = np.flatnonzero(self.leaf_levels == level)
+            order = np.argsort(self.leaf_indices[leaves])
+            # Pairs (sorted grid indices, leaf ids) of the leaves at level
+            self.level_leaves.append((self.leaf_indices[leaves][order], leaves[order]))
+
+    def dimension(self):
+        """Return the space dimesnion"""
+        return self.dim
+
+    def size(self):
+        """Return the number of cubes (leaves)"""
+        return len(self.leaf_levels)
+
+    def num_levels(self):
+        """Return the number of levels"""
+        return len(self.grids)
+
+    def get_lower_bounds(self):
+        """Return the grid lower bounds"""
+        return self.lower_bounds
+
+    def get_upper_bounds(self):
+        """Return the grid upper bounds"""
+        return self.upper_bounds
+
+    def get_grid_size(self):
+        """Return the grid size of level 0"""
+        return self.grid_size
+
+    def min_vertex(self, index):
+        """Return real coordinates of minimum vertex"""
+        grid = self.grids[self.leaf_levels[index]]
+        return grid.min_vertex(self.leaf_indices[index])
+
+    def max_vertex(self, index):
+        """Return real coordinates of maximum vertex"""
+        grid = self.grids[self.leaf_levels[index]]
+        return grid.max_vertex(self.leaf_indices[index])
+
+    def boxes(self, indices):
+        """Return an (N, 2*dim) array of rectangles (min vertex + max vertex) of the cubes"""
+        indices = np.asarray(indices, dtype=np.int64)
+        boxes = np.zeros((len(indices), 2 * self.dim))
+        levels = self.leaf_levels[indices]
+        for level in np.unique(levels):
+            mask = levels == level
+            boxes[mask] = self.grids[level].boxes(self.leaf_indices[indices[mask]])
+        return boxes
+
+    def subdivide(self, indices):
+        """Subdivide the cubes in indices. The remaining cubes keep their order and the
+           children are appended at the end. Return the array with the new indices of
+           the cubes not subdivided (-1 for subdivided cubes) and the array of indices
+           of the new cubes."""
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        num_cubes = self.size()
+        subdivided = np.zeros(num_cubes, dtype=bool)
+        subdivided[indices] = True
+        kept = np.flatnonzero(~subdivided)
+        new_indices = np.full(num_cubes, -1, dtype=np.int64)
+        new_indices[kept] = np.arange(len(kept))
+        # Integer coordinates of the children at the next level
+        levels = self.leaf_levels[indices]
+        children_levels = []
+        children_indices = []
+        for level in np.unique(levels):
+            if level + 1 == len(self.grids):
+                grid_size = [2 ** (level + 1) * n for n in self.grid_size]
+                self.grids.append(CMGDB_utils.CubicalGrid(self.lower_bounds, self.upper_bounds, grid_size))
+            coords = np.column_stack(self.grids[level].coordinates(self.leaf_indices[indices[levels == level]]))
+            for shift in itertools.product([0, 1], repeat=self.dim):
+                child_coords = 2 * coords + np.array(shift)
+                children_indices.append(self.grids[level + 1].index(tuple(child_coords.T)))
+                children_levels.append(np.full(len(coords), level + 1, dtype=np.int64))
+        if children_indices:
+            children_levels = np.concatenate(children_levels)
+            children_indices = np.concatenate(children_indices).astype(np.int64)
+        else:
+            children_levels = np.empty(0, dtype=np.int64)
+            children_indices = np.empty(0, dtype=np.int64)
+        self.leaf_levels = np.concatenate([self.leaf_levels[kept], children_levels])
+        self.leaf_indices = np.concatenate([self.leaf_indices[kept], children_indices])
+        self.update_level_leaves()
+        children = np.arange(len(kept), self.size())
+        return new_indices, children
+
+    def grid_cover(self, box, padding=False):
+        """Return the set of cubes intersecting the box"""
+        offsets, indices = self.grid_cover_batch([box], padding=padding)
+        return set(indices.tolist())
+
+    def grid_cover_batch(self, boxes, padding=False):
+        """Return the cubes intersecting each box of an (N, 2*dim) array of boxes in CSR form,
+           that is, a pair (offsets, indices) of flat arrays where the indices of the cubes
+           covering the k-th box are indices[offsets[k]:offsets[k + 1]]. The covers are
+           computed hierarchically: starting with the cover in the grid of level 0, the
+           leaves are kept and the subdivided cubes are replaced by their children in the
+           cover at the next level. Padding adds one layer of cubes of each level."""
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 2 * self.dim)
+        num_boxes = boxes.shape[0]
+        box_ids = [np.empty(0, dtype=np.int64)]
+        cubes = [np.empty(0, dtype=np.int64)]
+        # Cubes of the cover at level 0 (box and grid index of each cube)
+        offsets, level_cover = self.grids[0].grid_cover_batch(boxes, padding=padding)
+        cover_boxes = np.repeat(np.arange(num_boxes), np.diff(offsets))
+        for level, (level_indices, level_cubes) in enumerate(self.level_leaves):
+            # Keep the cubes of the cover which are leaves at this level
+            is_leaf = np.zeros(len(level_cover), dtype=bool)
+            if len(level_indices) > 0:
+                positions = np.minimum(np.searchsorted(level_indices, level_cover), len(level_indices) - 1)
+                is_leaf = level_indices[positions] == level_cover
+                box_ids.append(cover_boxes[is_leaf])
+                cubes.append(level_cubes[positions[is_leaf]])
+            # The other cubes of the cover are subdivided
+            cover_boxes = cover_boxes[~is_leaf]
+            if len(cover_boxes) == 0 or level + 1 == self.num_levels():
+                break
+            # Children of the subdivided cubes in the cover at the next level
+            min_coords, max_coords = self.grids[level + 1].cover_coordinate_ranges(boxes, padding=padding)
+            min_coords = min_coords[cover_boxes]
+            max_coords = max_coords[cover_boxes]
+            coords = np.column_stack(self.grids[level].coordinates(level_cover[~is_leaf]))
+            children_boxes = []
+            children_cover = []
+            for shift in itertools.product([0, 1], repeat=self.dim):
+                child_coords = 2 * coords + np.array(shift)
+                in_cover = np.all((child_coords >= min_coords) & (child_coords <= max_coords), axis=1)
+                children_boxes.append(cover_boxes[in_cover])
+                children_cover.append(self.grids[level + 1].index(tuple(child_coords[in_cover].T)))
+            cover_boxes = np.concatenate(children_boxes)
+            level_cover = np.concatenate(children_cover).astype(np.int64)
+        box_ids = np.concatenate(box_ids)
+        cubes = np.concatenate(cubes)
+        # Sort by box (and by cube for each box)
+        order = np.lexsort((cubes, box_ids))
+        offsets = np.zeros(num_boxes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(box_ids, minlength=num_boxes), out=offsets[1:])
+        return offsets, cubes[order]
@@ -2,8 +2,6 @@
 ### MIT LICENSE 2026 Marcio Gameiro
 
 import CMGDB_utils
-import DSGRN
-import CMGDB
 
 import matplotlib.pyplot as plt
 import matplotlib
@@ -16,39 +14,32 @@ def point_counts(X, adjacencies, cubical_complex):
     # Default counting dictionary
     counts = defaultdict(int)
     # One point per box if X is empty
-    if not X:
+    if len(X) == 0:
         tot_num_pts = len(adjacencies)
         return counts, tot_num_pts
-    for x in X:
-        # Find box containing x
-        x_l_bounds = [xi for xi in x]
-        x_u_bounds = [xi for xi in x]
-        x_box = x_l_bounds + x_u_bounds
-        # Get box containing x
-        x_box_inds = cubical_complex.grid_cover(x_box)
-        # Check to make sure this is true
-        # assert len(x_box_inds) <= 1:
-        for v in x_box_inds:
-            if v in adjacencies:
-                counts[v] += 1
+    # Get the cubes containing each point x (the cover of the degenerate box [x, x])
+    X = np.asarray(X, dtype=float).reshape(len(X), -1)
+    offsets, cubes = cubical_complex.grid_cover_batch(np.hstack([X, X]))
+    # Count the points in each of the adjacencies boxes
+    adjacencies = np.fromiter(adjacencies, dtype=np.int64, count=len(adjacencies))
+    cubes, cube_counts = np.unique(cubes[np.isin(cubes, adjacencies)], return_counts=True)
+    counts.update(zip(cubes.tolist(), cube_counts.tolist()))
     # Number of boxes with no points
     num_empty_boxes = len(adjacencies) - len(counts)
     # Number of points inside adjacencies boxes
-    counts_sum = sum(counts.values())
+    counts_sum = int(cube_counts.sum())
     # Total number of points to compute weight
     # Count one point per empty box (if any)
     tot_num_pts = counts_sum + num_empty_boxes
     return counts, tot_num_pts
 
-def weighted_adjacency_matrix(cubical_complex, model):
-    """Compute digraph and weighted adjacency matrix"""
-    # Define the digraph (multi-valued map)
-    num_verts = cubical_complex.size()
-    digraph = DSGRN.Digraph()
-    digraph.resize(num_verts)
-    # Compute the digraph and matrix
-    W = {} # Adjacency matrix as a dict
-    for u in range(num_verts):
+def weighted_adjacency_edges(cubical_complex, model, start, stop):
+    """Compute the weighted edges u -> v for the cubes u in range(start, stop).
+       Return the edges as a triple of arrays (sources, targets, weights)."""
+    sources = []
+    targets = []
+    weights = []
+    for u in range(start, stop):
         # Get min and max vertices of cube
         min_vert = cubical_complex.min_vertex(u)
         max_vert = cubical_complex.max_vertex(u)
@@ -59,51 +50,52 @@ def weighted_adjacency_matrix(cubical_complex, model):
         adjacencies = cubical_complex.grid_cover(F_box, padding=model.padding)
         # Count points in each adjacencies boxes
         counts, tot_num_pts = point_counts(X, adjacencies, cubical_complex)
-        # Add edges to digraph and matrix
         for v in adjacencies:
-            digraph.add_edge(u, v)
             # Number of points in v (or 1 if zero)
             n_pts = counts[v] if counts[v] else 1
-            W[(u, v)] = n_pts / tot_num_pts
+            sources.append(u)
+            targets.append(v)
+            weights.append(n_pts / tot_num_pts)
+    return np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64), np.array(weights, dtype=float)
+
+def weighted_multivalued_map_matrix(cubical_complex, model, workers=None):
+    """Compute the multi-valued map as a sparse (CSR) adjacency matrix and the weighted
+       adjacency matrix (also as a sparse CSR matrix). If workers > 1 the images of the cubes are computed in parallel."""
+    num_verts = int(cubical_complex.size())
+    # Compute the weighted edges
+    if workers and workers > 1:
+        results = CMGDB_utils.map_cube_chunks(weighted_adjacency_edges, cubical_complex, model, workers)
+        sources, targets, weights = [np.concatenate(arrays) for arrays in zip(*results)]
+    else:
+        sources, targets, weights = weighted_adjacency_edges(cubical_complex, model, 0, num_verts)
+    mvm = CMGDB_utils.edges_to_matrix(sources, targets, num_verts)
+    # Weighted adjacency matrix as a sparse (CSR) matrix
+    W = scipy.sparse.coo_matrix((weights, (sources, targets)), shape=(num_verts, num_verts)).tocsr()
+    W.sort_indices()
+    return mvm, W
+
+def weighted_adjacency_matrix(cubical_complex, model, workers=None):
+    """Compute digraph and weighted adjacency matrix. If workers > 1
+       the images of the cubes are computed in parallel."""
+    mvm, W = weighted_multivalued_map_matrix(cubical_complex, model, workers=workers)
+    digraph = CMGDB_utils.digraph_from_matrix(mvm)
     return digraph, W
 
-def morse_graph_adjacency_matrix(model, acyclic_check=True):
+def morse_graph_adjacency_matrix(model, acyclic_check=True, workers=None, conley_cache=None):
     """Compute Morse graph and weighted adjacency matrix"""
     # Construct the cubical complex
     cubical_complex = CMGDB_utils.CubicalGrid(model.lower_bounds, model.upper_bounds, model.grid_size)
     # Compute the multi-valued map and adjacency matrix
-    digraph, W = weighted_adjacency_matrix(cubical_complex, model)
-    # Compute Morse decomposition
-    morse_decomp = DSGRN.MorseDecomposition(digraph)
-    # Get number of Morse graph nodes
-    num_nodes = morse_decomp.poset().size()
-    # Create an indexing of the Morse graph vertices
-    vertex_mapping = {v: num_nodes - 1 - v for v in range(num_nodes)}
-    # Construct the Morse graph and add edges
-    morse_graph = CMGDB_utils.DirectedAcyclicGraph()
-    for v in range(num_nodes):
-        # Get corresponding Morse node
-        morse_node = vertex_mapping[v]
-        morse_set = set(morse_decomp.morseset(v))
-        # S subset F(S) for a Morse set. So X = F(S)
-        # X_cells = set(morse_set)
-        X_cells = set()
-        for u in morse_set:
-            X_cells.update(digraph.adjacencies(u))
-        # Define multivalued map F restricted to X
-        F = {u: [w for w in digraph.adjacencies(u) if w in X_cells] for u in X_cells}
-        A = list(X_cells - morse_set)
-        X = list(X_cells)
-        conley_index = CMGDB.ComputeConleyIndex(X, A, model.grid_size, model.periodic, F, acyclic_check)
-        conley_index_str = '(' + ', '.join(conley_index) + ')' if conley_index else 'Undefined'
-        morse_graph.add_vertex(morse_node, label=conley_index_str)
-    for u in range(num_nodes):
-        for v in morse_decomp.poset().children(u):
-            morse_graph.add_edge(vertex_mapping[u], vertex_mapping[v])
-    morse_graph_data = (morse_graph, morse_decomp, vertex_mapping)
+    mvm, W = weighted_multivalued_map_matrix(cubical_complex, model, workers=workers)
+    # Compute the Morse decomposition and the Conley indices
+    morse_graph_data = CMGDB_utils.conley_morse_graph_from_matrix(mvm, model.grid_size, model.periodic, acyclic_check,
+                                                                  workers=workers, conley_cache=conley_cache)
     return morse_graph_data, cubical_complex, W
 
 def attractor_eigenvalues(W, morse_graph_data, latt_attractors, att_vert, num_evals=100):
+    """Compute eigenvalues and eigenvectors of the transpose of the restriction of the
+       sparse weighted adjacency matrix W to the cells of the attractor att_vert. Return
+       the eigenvalues, eigenvectors, index of each cell and the sparse restriction M."""
     morse_graph, morse_decomp, vertex_mapping = morse_graph_data
     attractor_cells = {}
     att_vertices = sorted(latt_attractors.vertices())
@@ -123,22 +115,20 @@ def attractor_eigenvalues(W, morse_graph_data, latt_attractors, att_vert, num_ev
             att_cells.update(morse_set)
         attractor_cells[v] = att_cells
     # Get matrix corresponding to attractor
-    att_cells = attractor_cells[att_vert]
+    att_cells = np.array(sorted(attractor_cells[att_vert]), dtype=np.int64)
     n_att_cells = len(att_cells)
     print('Number of cells in attractor:', n_att_cells)
-    att_cell_index = {val: index for index, val in enumerate(att_cells)}
-    M = np.zeros((n_att_cells, n_att_cells))
-    for (u, v) in W:
-        if (u in att_cells) and (v in att_cells):
-            i = att_cell_index[u]
-            j = att_cell_index[v]
-            M[i, j] = W[(u, v)]
-    if num_evals >= n_att_cells:
+    att_cell_index = {val: index for index, val in enumerate(att_cells.tolist())}
+    # Sparse submatrix of W (sparse or dict) with the rows and columns of the attractor cells
+    num_cells = int(att_cells[-1]) + 1 if n_att_cells else 0
+    M = CMGDB_utils.weight_matrix(W, num_cells)[att_cells][:, att_cells]
+    # The sparse eigensolver computes at most n_att_cells - 2 eigenvalues
+    if num_evals >= n_att_cells - 1:
         # Compute all eigenvalues/eigenvecs
-        eigen_vals, eigen_vecs = np.linalg.eig(M.T)
+        eigen_vals, eigen_vecs = np.linalg.eig(M.T.toarray())
     else:
         # Compute only some eigenvalues/eigenvecs
-        eigen_vals, eigen_vecs = scipy.sparse.linalg.eigs(M.T, k=num_evals)
+        eigen_vals, eigen_vecs = scipy.sparse.linalg.eigs(M.T.tocsr(), k=num_evals)
     return eigen_vals, eigen_vecs, att_cell_index, M
 
 def eigenvectos_min_attractor(eigen_vals, eigen_vecs, max_att, mg_data, latt_att, att_cell_index, tol=1e-12):
@@ -90,3 +90,62 @@ def MultiBoxMap(f, box, box_size=None, mode='corners', num_pts=10):
     # Get list of boxes containing image points
     f_box = [Y_lb + Y_up for Y_lb, Y_up in zip(Y_l_bounds, Y_u_bounds)]
     return f_box
+
+def CornerPointsBatch(boxes):
+    """Return corner points of an (N, 2*dim) array of rectangles as an (N, 2^dim, dim) array"""
+    boxes = np.asarray(boxes, dtype=float)
+    dim = boxes.shape[1] // 2
+    # Binary selectors for the corners in the same order as itertools.product
+    selectors = np.array(list(itertools.product([False, True], repeat=dim)))
+    # Pick lower or upper bound according to each selector
+    X = np.where(selectors[None, :, :], boxes[:, None, dim:], boxes[:, None, :dim])
+    return X
+
+def CenterPointsBatch(boxes):
+    """Return center points of an (N, 2*dim) array of rectangles as an (N, 1, dim) array"""
+    boxes = np.asarray(boxes, dtype=float)
+    dim = boxes.shape[1] // 2
+    X = (boxes[:, None, :dim] + boxes[:, None, dim:]) / 2
+    return X
+
+def SamplePointsBatch(boxes, num_pts):
+    """Return num_pts random points in each of an (N, 2*dim) array of rectangles
+       as an (N, num_pts, dim) array"""
+    boxes = np.asarray(boxes, dtype=float)
+    dim = boxes.shape[1] // 2
+    num_boxes = boxes.shape[0]
+    X = np.random.uniform(boxes[:, None, :dim], boxes[:, None, dim:], size=(num_boxes, num_pts, dim))
+    return X
+
+def BatchBoxMap(f, boxes, mode='corners', num_pts=10):
+    """Return an (N, 2*dim) array of rectangles containing the images of the input
+       (N, 2*dim) array of rectangles. The function f must be vectorized, that is,
+       it must map an (M, dim) array of points to an (M, dim) array of images."""
+    f_boxes, X = BatchBoxMapSample(f, boxes, mode=mode, num_pts=num_pts)
+    return f_boxes
+
+def BatchBoxMapSample(f, boxes, mode='random', num_pts=100):
+    """Return an (N, 2*dim) array of rectangles containing the images of the input
+       (N, 2*dim) array of rectangles and the (N, num_pts, dim) array of sampled points
+       if mode = 'random'. The function f must map an (M, dim) array of points to an
+       (M, dim) array of images."""
+    boxes = np.asarray(boxes, dtype=float)
+    num_boxes = boxes.shape[0]
+    dim = boxes.shape[1] // 2
+    if mode == 'corners': # Compute at corner points
+        X = CornerPointsBatch(boxes)
+    elif mode == 'center': # Compute at center points
+        # Return degenerate rectangles with a single point
+        X = CenterPointsBatch(boxes)
+    elif mode == 'random': # Compute at random points
+        X = SamplePointsBatch(boxes, num_pts)
+    else: # Unknown mode
+        return np.empty((0, 2 * dim)), np.empty((0, 0, dim))
+    # Evaluate f at all points of all boxes at once
+    Y = np.asarray(f(X.reshape(-1, dim)), dtype=float).reshape(X.shape)
+    # Get lower and upper bounds of the images of each box
+    f_boxes = np.hstack([np.min(Y, axis=1), np.max(Y, axis=1)])
+    # Return X if mode = 'random'
+    if mode == 'random':
+        return f_boxes, X
+    return f_boxes, np.empty((num_boxes, 0, dim))
@@ -1,10 +1,10 @@
 ### BoxMapData.py
 ### MIT LICENSE 2025 Marcio Gameiro
 
-# TODO: 1) Use a KD-Tree or a grid to make it more efficient to find the points inside a rectangle
-#       2) Unify the names rect and box (rename everything as box)
+# TODO: 1) Unify the names rect and box (rename everything as box)
 
 import numpy as np
+import scipy
 
 class BoxMapData:
     """Define a box map from datasets X and Y, where the points in Y are the images of
@@ -13,14 +13,32 @@ class BoxMapData:
        rect. If there are no X points in rect the result depends on the flag map_empty:
        If map_empty is 'outside' return a rectangle outiside the domain, if map_empty
        is 'terminate' raise an exception, and if map_empty is 'interp' use a form of
-       interpolation to compute the image."""
+       interpolation to compute the image. The points in X are indexed by a uniform
+       grid of buckets to find the points inside a rectangle. If grid_size is given
+       the buckets are the cubes of the grid with bounds lower_bounds and upper_bounds
+       (or the bounds of X if not given), otherwise a grid size is chosen from the
+       number of points. If bulk is True all the points in X are binned into the cubes
+       of the grid given by lower_bounds, upper_bounds and grid_size at once, and the
+       image of every cube is computed in a single pass. In this case the box map can
+       be evaluated on an (N, 2*dim) array of grid cubes (map_type 'BatchBoxMap').
+       If interp_method is 'pyramid' the interpolation uses a precomputed pyramid of
+       the counts and image bounds of the points at successively coarser resolutions
+       of the bucket grid, and the image of an empty rectangle is the image of the
+       smallest nonempty ancestor of the bucket containing its center."""
 
     def __init__(self, X, Y, map_empty='interp', multi_box=False, box_size=None, box_size_factor=1.0,
-                 lower_bounds=None, upper_bounds=None, domain_padding=False, padding=False):
+                 lower_bounds=None, upper_bounds=None, domain_padding=False, padding=False, grid_size=None, bulk=False,
+                 interp_method='grow'):
         if map_empty not in ['interp', 'outside', 'terminate']:
             raise ValueError("Invalid value for map_empty. Allowed values are: 'interp', 'outside', or 'terminate'")
         if map_empty == 'outside' and (lower_bounds is None or upper_bounds is None):
             raise ValueError("The bounds lower_bounds and upper_bounds must be provided if map_empty is 'outside'")
+        if interp_method not in ['grow', 'pyramid']:
+            raise ValueError("Invalid value for interp_method. Allowed values are: 'grow' or 'pyramid'")
+        if bulk and (lower_bounds is None or upper_bounds is None or grid_size is None):
+            raise ValueError("The bounds lower_bounds, upper_bounds and grid_size must be provided if bulk is True")
+        if bulk and multi_box:
+            raise ValueError("The bulk mode is only available if multi_box is False")
         self.X = np.array(X)
         self.Y = np.array(Y)
         self.map_empty = map_empty
@@ -38,27 +56,238 @@ class BoxMapData:
             self.box_size = [box_size] * self.dim
         # Factor for default box_size
         self.box_size_factor = box_size_factor
+        # Build the spatial index of the points in X
+        self.build_index(grid_size)
+        # Build the occupancy pyramid for interpolation
+        self.interp_method = interp_method
+        self.pyramid = self.build_pyramid() if map_empty == 'interp' and interp_method == 'pyramid' else None
+        # Compute the images of all grid cubes at once in bulk mode
+        self.bulk = bulk
+        self.cube_images = self.compute_cube_images() if bulk else None
 
     def __call__(self, rect):
+        if self.bulk and np.ndim(rect) == 2:
+            return self.compute_batch(rect)
         return self.compute(rect)
 
+    def build_index(self, grid_size=None):
+        """Build a uniform grid of buckets indexing the points in X. The points are
+           sorted by bucket and offsets[b]:offsets[b + 1] gives the range of the
+           points of bucket b in the sorted order."""
+        num_pts = self.X.shape[0]
+        if grid_size is None:
+            # About 16 points per bucket on average
+            grid_size = [max(int((num_pts / 16) ** (1 / self.dim)), 1)] * self.dim
+        self.index_grid_size = np.array(grid_size, dtype=np.int64)
+        # Use the domain bounds if given or the bounds of X otherwise
+        if self.lower_bounds is not None and self.upper_bounds is not None:
+            self.index_lower_bounds = np.array(self.lower_bounds, dtype=float)
+            index_upper_bounds = np.array(self.upper_bounds, dtype=float)
+        elif num_pts > 0:
+            self.index_lower_bounds = np.min(self.X, axis=0).astype(float)
+            index_upper_bounds = np.max(self.X, axis=0).astype(float)
+        else:
+            self.index_lower_bounds = np.zeros(self.dim)
+            index_upper_bounds = np.ones(self.dim)
+        index_widths = index_upper_bounds - self.index_lower_bounds
+        # Avoid zero bucket sizes for degenerate data
+        index_widths[index_widths <= 0] = 1.0
+        self.index_bucket_sizes = index_widths / self.index_grid_size
+        # Get bucket of each point in X and sort the points by bucket
+        buckets = self.bucket_indices(self.X)
+        self.index_order = np.argsort(buckets, kind='stable')
+        num_buckets = int(np.prod(self.index_grid_size))
+        counts = np.bincount(buckets, minlength=num_buckets)
+        self.index_offsets = np.zeros(num_buckets + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.index_offsets[1:])
+
+    def bucket_coordinates(self, points):
+        """Return the integer coordinates of the buckets containing the points.
+           Points outside the index bounds are assigned to the boundary buckets."""
+        coords = np.floor((points - self.index_lower_bounds) / self.index_bucket_sizes)
+        return np.clip(coords, 0, self.index_grid_size - 1).astype(np.int64)
+
+    def bucket_indices(self, points):
+        """Return the indices of the buckets containing the points"""
+        coords = self.bucket_coordinates(np.asarray(points, dtype=float).reshape(-1, self.dim))
+        return np.ravel_multi_index(tuple(coords.T), self.index_grid_size, order='F')
+
+    def rect_candidates(self, rect):
+        """Return the indices of the points of X in the buckets intersecting rect"""
+        min_coords, max_coords = self.bucket_coordinates(np.array([rect[:self.dim], rect[self.dim:]], dtype=float))
+        # Get the buckets intersecting rect
+        coord_ranges = [np.arange(min_c, max_c + 1) for min_c, max_c in zip(min_coords, max_coords)]
+        coords = [c.ravel() for c in np.meshgrid(*coord_ranges, indexing='ij')]
+        buckets = np.ravel_multi_index(coords, self.index_grid_size, order='F')
+        # Gather the ranges of sorted points of each bucket
+        starts = self.index_offsets[buckets]
+        lengths = self.index_offsets[buckets + 1] - starts
+        positions = np.arange(np.sum(lengths)) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.index_order[positions]
+
+    def compute_cube_images(self):
+        """Compute an (num_cubes, 2*dim) array with the image rectangles of all the cubes
+           of the index grid. The points in X are binned into cubes in a single pass and
+           the bounds of the images are computed by a segmented min/max reduction of Y.
+           A point on the common face of two cubes is assigned to only one of them."""
+        grid_size = self.index_grid_size
+        upper_bounds = np.array(self.upper_bounds, dtype=float)
+        # Bin the points of X into the cubes of the grid extended by one layer of
+        # cubes on each side (the extra layer is only used for domain padding)
+        coords = np.floor((self.X - self.index_lower_bounds) / self.index_bucket_sizes).astype(np.int64)
+        # Points on the upper boundary belong to the last cube
+        coords[(coords == grid_size) & (self.X <= upper_bounds)] -= 1
+        coords += 1
+        ext_shape = tuple(grid_size + 2)
+        valid = np.all((coords >= 0) & (coords < grid_size + 2), axis=1)
+        cubes = np.ravel_multi_index(tuple(coords[valid].T), ext_shape, order='F')
+        # Sort the points by cube index
+        order = np.argsort(cubes, kind='stable')
+        Y_sorted = self.Y[valid][order]
+        counts = np.bincount(cubes, minlength=int(np.prod(ext_shape)))
+        nonempty = counts > 0
+        starts = (np.cumsum(counts) - counts)[nonempty]
+        # Segmented min/max reduction of Y over the cubes
+        Y_l_bounds = np.full((len(counts), self.dim), np.inf)
+        Y_u_bounds = np.full((len(counts), self.dim), -np.inf)
+        if len(starts) > 0:
+            Y_l_bounds[nonempty] = np.minimum.reduceat(Y_sorted, starts, axis=0)
+            Y_u_bounds[nonempty] = np.maximum.reduceat(Y_sorted, starts, axis=0)
+        # Reshape as arrays on the extended grid
+        to_grid = lambda a: a.reshape(ext_shape, order='F')
+        Y_l_bounds = [to_grid(Y_l_bounds[:, k]) for k in range(self.dim)]
+        Y_u_bounds = [to_grid(Y_u_bounds[:, k]) for k in range(self.dim)]
+        nonempty = to_grid(nonempty)
+        # Slices of the cubes of the (non extended) grid
+        interior = tuple(slice(1, n + 1) for n in grid_size)
+        empty = ~nonempty[interior].ravel(order='F')
+        # Raise an exception if empty image and map_empty is terminate
+        if self.map_empty == 'terminate' and np.any(empty):
+            raise ValueError(f'Cube {np.flatnonzero(empty)[0]} has empty image')
+        # Pad domain rectangle if flag is set (union with the neighboring cubes)
+        if self.domain_padding:
+            Y_l_bounds = [scipy.ndimage.minimum_filter(Y_l, size=3, mode='constant', cval=np.inf) for Y_l in Y_l_bounds]
+            Y_u_bounds = [scipy.ndimage.maximum_filter(Y_u, size=3, mode='constant', cval=-np.inf) for Y_u in Y_u_bounds]
+            nonempty = scipy.ndimage.maximum_filter(nonempty, size=3, mode='constant', cval=False)
+        Y_l_bounds = np.column_stack([Y_l[interior].ravel(order='F') for Y_l in Y_l_bounds])
+        Y_u_bounds = np.column_stack([Y_u[interior].ravel(order='F') for Y_u in Y_u_bounds])
+        nonempty = nonempty[interior].ravel(order='F')
+        # Add padding if padding is True
+        pad = self.index_bucket_sizes if self.padding else 0
+        cube_images = np.hstack([Y_l_bounds - pad, Y_u_bounds + pad])
+        # Map to a box outside if empty image and map_empty is outside
+        if self.map_empty == 'outside':
+            cube_images[empty] = np.concatenate([upper_bounds + 1, upper_bounds + 2])
+        # Interpolate if empty image and map_empty is interp
+        if self.map_empty == 'interp':
+            for index in np.flatnonzero(~nonempty):
+                coords = np.array(np.unravel_index(index, tuple(grid_size), order='F'))
+                min_vert = self.index_lower_bounds + coords * self.index_bucket_sizes
+                max_vert = min_vert + self.index_bucket_sizes
+                Y_rect = self.interpolate(list(min_vert) + list(max_vert))
+                cube_images[index] = np.concatenate([np.min(Y_rect, axis=0) - pad, np.max(Y_rect, axis=0) + pad])
+        return cube_images
+
+    def compute_batch(self, rects):
+        """Return the (N, 2*dim) array of image rectangles of an (N, 2*dim) array of cubes
+           of the grid. The cubes are identified by their centers. The rectangles which
+           are not cubes of the grid (for example cubes of a different grid or of a
+           refined level of an adaptive grid) are computed one at a time by compute."""
+        rects = np.asarray(rects, dtype=float).reshape(-1, 2 * self.dim)
+        # Check that each rectangle is a cube of the grid (size and position)
+        min_coords = (rects[:, :self.dim] - self.index_lower_bounds) / self.index_bucket_sizes
+        max_coords = (rects[:, self.dim:] - self.index_lower_bounds) / self.index_bucket_sizes
+        coords = np.rint(min_coords)
+        is_cube = np.all(np.isclose(min_coords, coords) & np.isclose(max_coords, coords + 1) &
+                         (coords >= 0) & (coords < self.index_grid_size), axis=1)
+        centers = (rects[:, :self.dim] + rects[:, self.dim:]) / 2
+        f_rects = self.cube_images[self.bucket_indices(centers)]
+        for k in np.flatnonzero(~is_cube):
+            f_rects[k] = self.compute(list(rects[k]))
+        return f_rects
+
     def map_points(self, rect):
         """Return the points in Y which are image of the points in X inside of rect."""
         l_bounds = rect[:self.dim]
         u_bounds = rect[self.dim:]
-        # Get index mask for the points in X inside rect
-        index_mask = np.all((self.X >= l_bounds) & (self.X <= u_bounds), axis=1)
-        # Get the corresponding points in Y
-        Y_rect = self.Y[index_mask]
+        # Get the points in the buckets intersecting rect
+        candidates = self.rect_candidates(rect)
+        X_cand = self.X[candidates]
+        # Get index mask for the candidate points in X inside rect
+        index_mask = np.all((X_cand >= l_bounds) & (X_cand <= u_bounds), axis=1)
+        # Get the corresponding points in Y (in the order of X)
+        Y_rect = self.Y[np.sort(candidates[index_mask])]
         return Y_rect
 
+    def build_pyramid(self):
+        """Build the occupancy pyramid of the bucket grid. Level 0 has the number of
+           points of X and the bounds of their images in Y for each bucket, and each
+           level merges blocks of 2^dim cells of the previous level."""
+        grid_shape = tuple(self.index_grid_size)
+        # Compute counts and image bounds of the buckets
+        counts = np.diff(self.index_offsets)
+        nonempty = counts > 0
+        Y_sorted = self.Y[self.index_order]
+        Y_l_bounds = np.full((len(counts), self.dim), np.inf)
+        Y_u_bounds = np.full((len(counts), self.dim), -np.inf)
+        if np.any(nonempty):
+            Y_l_bounds[nonempty] = np.minimum.reduceat(Y_sorted, self.index_offsets[:-1][nonempty], axis=0)
+            Y_u_bounds[nonempty] = np.maximum.reduceat(Y_sorted, self.index_offsets[:-1][nonempty], axis=0)
+        level = (counts.reshape(grid_shape, order='F'),
+                 Y_l_bounds.reshape(grid_shape + (self.dim,), order='F'),
+                 Y_u_bounds.reshape(grid_shape + (self.dim,), order='F'))
+        pyramid = [level]
+        # Merge blocks of cells until there is a single cell
+        while any(n > 1 for n in pyramid[-1][0].shape):
+            counts, Y_l_bounds, Y_u_bounds = pyramid[-1]
+            # Pad to an even number of cells in each dimension
+            pad_width = [(0, n % 2) for n in counts.shape]
+            counts = np.pad(counts, pad_width)
+            Y_l_bounds = np.pad(Y_l_bounds, pad_width + [(0, 0)], constant_values=np.inf)
+            Y_u_bounds = np.pad(Y_u_bounds, pad_width + [(0, 0)], constant_values=-np.inf)
+            # Split each dimension into (cell, 2) and reduce over the blocks
+            blocks_shape = tuple(m for n in counts.shape for m in (n // 2, 2))
+            block_axes = tuple(range(1, 2 * self.dim, 2))
+            level = (counts.reshape(blocks_shape).sum(axis=block_axes),
+                     Y_l_bounds.reshape(blocks_shape + (self.dim,)).min(axis=block_axes),
+                     Y_u_bounds.reshape(blocks_shape + (self.dim,)).max(axis=block_axes))
+            pyramid.append(level)
+        return pyramid
+
+    def interpolate_pyramid(self, rect):
+        """Compute the image of the empty rectangle rect using the occupancy pyramid.
+           Return the images in Y of the points of the smallest nonempty ancestor of
+           the bucket containing the center of rect. If multi_box is False only the
+           two points with the lower and upper bounds of these images are returned."""
+        center = [(rect[k] + rect[k + self.dim]) / 2 for k in range(self.dim)]
+        coords = self.bucket_coordinates(np.array(center, dtype=float))
+        for level, (counts, Y_l_bounds, Y_u_bounds) in enumerate(self.pyramid):
+            cell = tuple(coords >> level)
+            if counts[cell] > 0:
+                break
+        if counts[cell] == 0:
+            raise ValueError('Cannot interpolate without data points')
+        if not self.multi_box:
+            return np.array([Y_l_bounds[cell], Y_u_bounds[cell]])
+        # Get the points in the buckets of the ancestor cell
+        min_coords = np.array(cell) << level
+        max_coords = np.minimum((np.array(cell) + 1) << level, self.index_grid_size) - 1
+        coord_ranges = [np.arange(min_c, max_c + 1) for min_c, max_c in zip(min_coords, max_coords)]
+        buckets = np.ravel_multi_index([c.ravel() for c in np.meshgrid(*coord_ranges, indexing='ij')],
+                                       self.index_grid_size, order='F')
+        points = np.concatenate([self.index_order[self.index_offsets[b]:self.index_offsets[b + 1]] for b in buckets])
+        return self.Y[np.sort(points)]
+
     def interpolate(self, rect):
         """Compute the image of the empty rectangle rect using interpolation.
            Double the size of the rectangle until there are X points inside
-           and return a rectangle with the corresponding points in Y."""
+           and return a rectangle with the corresponding points in Y. If
+           interp_method is 'pyramid' use the occupancy pyramid instead."""
         Y_rect = self.map_points(rect)
         if Y_rect.size > 0:
             return Y_rect
+        if self.interp_method == 'pyramid':
+            return self.interpolate_pyramid(rect)
         l_bounds = rect[:self.dim]
         u_bounds = rect[self.dim:]
         # Double rectangle size until nonempty
@@ -5,21 +5,71 @@ import DSGRN
 import CMGDB
 import CMGDB_utils
 
-def compute_multivalued_map(cubical_complex, model):
-    """Compute the multi-valued map (digraph)"""
-    # Define the digraph (multi-valued map)
-    num_verts = cubical_complex.size()
-    digraph = DSGRN.Digraph()
-    digraph.resize(num_verts)
-    # Just assign the edges if multi-valued map is given
+import numpy as np
+import scipy
+import concurrent.futures
+import multiprocessing
+
+# Cubical complex and model used by the worker processes
+_worker_data = None
+
+def _init_worker(cubical_complex, model):
+    """Store the cubical complex and model in the worker process"""
+    global _worker_data
+    _worker_data = (cubical_complex, model)
+    # Reseed so forked workers do not share the random sampling state
+    np.random.seed()
+
+def _run_worker(func, start, stop):
+    """Evaluate func on the cubes in range(start, stop) in the worker process"""
+    cubical_complex, model = _worker_data
+    return func(cubical_complex, model, start, stop)
+
+def map_cube_chunks(func, cubical_complex, model, workers, chunks_per_worker=4):
+    """Split the range of cubes into chunks and evaluate func(cubical_complex, model, start, stop)
+       on each chunk in a pool of worker processes. Return the list of results in the order of
+       the chunks. The fork start method is used when available, so that model.F does not need
+       to be picklable. Otherwise the cubical complex and model are pickled to the workers."""
+    num_verts = int(cubical_complex.size())
+    num_chunks = max(min(workers * chunks_per_worker, num_verts), 1)
+    bounds = np.linspace(0, num_verts, num_chunks + 1).astype(np.int64)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+    else:
+        mp_context = None
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_init_worker,
+                                                initargs=(cubical_complex, model)) as executor:
+        futures = [executor.submit(_run_worker, func, int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+        results = [future.result() for future in futures]
+    return results
+
+def multivalued_map_edges(cubical_complex, model, start, stop):
+    """Compute the edges u -> v of the multi-valued map for the cubes u in range(start, stop).
+       Return the edges as a pair of arrays (sources, targets)."""
+    sources = []
+    targets = []
+    # Just get the edges if multi-valued map is given
     if model.map_type == 'GraphMap' or model.map_type == 'G':
-        for u in range(num_verts):
+        for u in range(start, stop):
             adjacencies = model.F[u]
-            for v in adjacencies:
-                digraph.add_edge(u, v)
-        return digraph
-    # Compute the digraph
-    for u in range(num_verts):
+            sources.extend([u] * len(adjacencies))
+            targets.extend(adjacencies)
+        return np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64)
+    # Evaluate F on batches of cubes if F is vectorized
+    if model.map_type == 'BatchBoxMap' or model.map_type == 'BB':
+        for batch_start in range(start, stop, model.batch_size):
+            cube_indices = np.arange(batch_start, min(batch_start + model.batch_size, stop))
+            # F maps an (N, 2*dim) array of boxes to an (N, 2*dim) array of boxes
+            F_boxes = model.F(cubical_complex.boxes(cube_indices))
+            # Get cubes covering each box in F_boxes
+            offsets, indices = cubical_complex.grid_cover_batch(F_boxes, padding=model.padding)
+            sources.append(np.repeat(cube_indices, np.diff(offsets)))
+            targets.append(indices)
+        if not sources:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(sources).astype(np.int64), np.concatenate(targets).astype(np.int64)
+    # Compute the edges
+    for u in range(start, stop):
         # Get min and max vertices of cube
         min_vert = cubical_complex.min_vertex(u)
         max_vert = cubical_complex.max_vertex(u)
@@ -31,18 +81,127 @@ def compute_multivalued_map(cubical_complex, model):
             adjacencies = cubical_complex.grid_cover(F_box, padding=model.padding)
         if model.map_type == 'MultiBoxMap' or model.map_type == 'M':
             # Get list of cubes covering the list of boxes returned by F
-            adjacencies = {v for F_b in F_box for v in cubical_complex.grid_cover(F_b, padding=model.padding)}
-        # Add edges to digraph
-        for v in adjacencies:
+            offsets, indices = cubical_complex.grid_cover_batch(F_box, padding=model.padding)
+            adjacencies = np.unique(indices)
+        sources.extend([u] * len(adjacencies))
+        targets.extend(adjacencies)
+    return np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64)
+
+def edges_to_matrix(sources, targets, num_verts):
+    """Return the sparse (CSR) adjacency matrix of the edges sources -> targets.
+       Duplicated edges are merged and the column indices of each row are sorted."""
+    data = np.ones(len(sources), dtype=bool)
+    mvm = scipy.sparse.csr_matrix((data, (sources, targets)), shape=(num_verts, num_verts))
+    mvm.sum_duplicates()
+    mvm.sort_indices()
+    return mvm
+
+def digraph_from_matrix(mvm, chunk_size=2**20):
+    """Construct a DSGRN digraph from the sparse (CSR) adjacency matrix mvm. The edges
+       are added by blocks of rows with about chunk_size edges each, converted to lists
+       of ints a block at a time to keep the memory usage bounded."""
+    num_verts = mvm.shape[0]
+    indptr = mvm.indptr
+    digraph = DSGRN.Digraph()
+    digraph.resize(num_verts)
+    start = 0
+    while start < num_verts:
+        # Rows in the block [start, stop) with about chunk_size edges
+        stop = int(np.searchsorted(indptr, indptr[start] + chunk_size, side='right'))
+        stop = min(max(stop - 1, start + 1), num_verts)
+        sources = np.repeat(np.arange(start, stop), np.diff(indptr[start:stop + 1])).tolist()
+        targets = mvm.indices[indptr[start]:indptr[stop]].tolist()
+        for u, v in zip(sources, targets):
             digraph.add_edge(u, v)
+        start = stop
     return digraph
 
-def ComputeMorseGraph(model):
+def multivalued_map_matrix(cubical_complex, model, workers=None, cache=None):
+    """Compute the multi-valued map as a sparse (CSR) adjacency matrix. If workers > 1
+       the images of the cubes are computed in parallel by that many processes. If a
+       MultivaluedMapCache is given the multi-valued map is loaded from the cache if
+       available and saved to the cache otherwise."""
+    if cache is not None:
+        key = cache.key(model)
+        mvm = cache.load(key)
+        if mvm is not None:
+            return mvm
+        mvm = multivalued_map_matrix(cubical_complex, model, workers=workers)
+        cache.save(key, mvm)
+        return mvm
+    num_verts = int(cubical_complex.size())
+    # Compute the edges of the multi-valued map. The multi-valued
+    # map is not evaluated in parallel if it is already given.
+    if workers and workers > 1 and not (model.map_type == 'GraphMap' or model.map_type == 'G'):
+        results = map_cube_chunks(multivalued_map_edges, cubical_complex, model, workers)
+        sources = np.concatenate([result[0] for result in results])
+        targets = np.concatenate([result[1] for result in results])
+    else:
+        sources, targets = multivalued_map_edges(cubical_complex, model, 0, num_verts)
+    return edges_to_matrix(sources, targets, num_verts)
+
+def compute_multivalued_map(cubical_complex, model, workers=None, cache=None):
+    """Compute the multi-valued map (digraph). If workers > 1 the images
+       of the cubes are computed in parallel by that many processes."""
+    mvm = multivalued_map_matrix(cubical_complex, model, workers=workers, cache=cache)
+    return digraph_from_matrix(mvm)
+
+def morse_set_index_pair(mvm, morse_set):
+    """Return the index pair (X, A) of a Morse set S, where X = F(S) and A = X - S,
+       and the multi-valued map F restricted to X as a dict of adjacency lists."""
+    morse_set = np.asarray(morse_set, dtype=np.int64)
+    # S subset F(S) for a Morse set. So X = F(S)
+    X = np.unique(mvm[morse_set].indices)
+    A = np.setdiff1d(X, morse_set)
+    # Define multivalued map F restricted to X
+    F_X = mvm[X][:, X]
+    F = {u: X[F_X.indices[F_X.indptr[k]:F_X.indptr[k + 1]]].tolist() for k, u in enumerate(X.tolist())}
+    return X.tolist(), A.tolist(), F
+
+def _conley_index_worker(X, A, grid_size, periodic, F, acyclic_check):
+    """Compute the Conley index in the worker process"""
+    return CMGDB.ComputeConleyIndex(X, A, grid_size, periodic, F, acyclic_check)
+
+def compute_conley_indices(index_pairs, grid_size, periodic, acyclic_check=True, workers=None, conley_cache=None):
+    """Compute the Conley indices of a list of index pairs (X, A, F), where F is the
+       multi-valued map restricted to X. If workers > 1 the Conley indices are computed
+       in parallel by that many processes. Return the list of Conley indices in the
+       order of index_pairs. A ConleyIndexCache is used if conley_cache is given."""
+    conley_indices = [None] * len(index_pairs)
+    keys = [None] * len(index_pairs)
+    if conley_cache is not None:
+        for k, (X, A, F) in enumerate(index_pairs):
+            keys[k], conley_indices[k] = conley_cache.get(X, A, grid_size, periodic, F, acyclic_check)
+    # Index pairs to compute (largest first for a better load balance)
+    pending = sorted([k for k in range(len(index_pairs)) if conley_indices[k] is None],
+                     key=lambda k: len(index_pairs[k][0]), reverse=True)
+    if workers and workers > 1 and len(pending) > 1:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context('fork')
+        else:
+            mp_context = None
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+            futures = {}
+            for k in pending:
+                X, A, F = index_pairs[k]
+                futures[k] = executor.submit(_conley_index_worker, X, A, grid_size, periodic, F, acyclic_check)
+            for k in pending:
+                conley_indices[k] = futures[k].result()
+    else:
+        for k in pending:
+            X, A, F = index_pairs[k]
+            conley_indices[k] = CMGDB.ComputeConleyIndex(X, A, grid_size, periodic, F, acyclic_check)
+    if conley_cache is not None:
+        for k in pending:
+            conley_cache.put(keys[k], conley_indices[k])
+    return conley_indices
+
+def ComputeMorseGraph(model, workers=None, cache=None):
     """Compute cubical complex and Morse graph"""
     # Construct the cubical complex
     cubical_complex = CMGDB_utils.CubicalGrid(model.lower_bounds, model.upper_bounds, model.grid_size)
     # Compute the multi-valued map (digraph)
-    digraph = compute_multivalued_map(cubical_complex, model)
+    digraph = compute_multivalued_map(cubical_complex, model, workers=workers, cache=cache)
     # Compute Morse decomposition
     morse_decomp = DSGRN.MorseDecomposition(digraph)
     # Get number of Morse graph nodes
@@ -60,38 +219,95 @@ def ComputeMorseGraph(model):
     morse_graph_data = (morse_graph, morse_decomp, vertex_mapping)
     return morse_graph_data, cubical_complex
 
-def ComputeConleyMorseGraph(model, acyclic_check=True):
-    """Compute cubical complex and Conley Morse graph"""
-    # Construct the cubical complex
-    cubical_complex = CMGDB_utils.CubicalGrid(model.lower_bounds, model.upper_bounds, model.grid_size)
-    # Compute the multi-valued map (digraph)
-    digraph = compute_multivalued_map(cubical_complex, model)
+def cube_images(cubical_complex, model, indices):
+    """Return the (N, 2*dim) array of the boxes F(box) for the cubes in indices"""
+    boxes = cubical_complex.boxes(indices)
+    if model.map_type == 'BatchBoxMap' or model.map_type == 'BB':
+        # Evaluate F on batches of cubes
+        F_boxes = [model.F(boxes[k:k + model.batch_size]) for k in range(0, len(boxes), model.batch_size)]
+        return np.concatenate(F_boxes) if F_boxes else np.empty((0, boxes.shape[1]))
+    if model.map_type == 'BoxMap' or model.map_type == 'B':
+        return np.array([model.F(list(box)) for box in boxes], dtype=float).reshape(boxes.shape)
+    raise ValueError("Invalid map_type. Allowed values are: 'BoxMap' or 'BatchBoxMap'")
+
+def ComputeMorseGraphAdaptive(model, num_refinements):
+    """Compute adaptive cubical complex and Morse graph. Start with the grid of size
+       model.grid_size and subdivide the cubes in the Morse sets num_refinements times,
+       recomputing the multi-valued map and the Morse decomposition after each
+       subdivision. The map F is only evaluated on the new cubes. The Morse sets
+       are computed at the resolution grid_size * 2^num_refinements, but the order
+       between them is computed through the coarser cubes outside the Morse sets,
+       so it may have more relations than the order on the uniform grid."""
+    # Construct the adaptive cubical complex
+    cubical_complex = CMGDB_utils.AdaptiveCubicalGrid(model.lower_bounds, model.upper_bounds, model.grid_size)
+    # Images of all the cubes
+    F_boxes = cube_images(cubical_complex, model, np.arange(cubical_complex.size()))
+    for level in range(num_refinements + 1):
+        # Compute the multi-valued map from the images of the cubes
+        num_verts = cubical_complex.size()
+        offsets, indices = cubical_complex.grid_cover_batch(F_boxes, padding=model.padding)
+        sources = np.repeat(np.arange(num_verts), np.diff(offsets))
+        digraph = digraph_from_matrix(edges_to_matrix(sources, indices, num_verts))
+        # Compute Morse decomposition
+        morse_decomp = DSGRN.MorseDecomposition(digraph)
+        if level == num_refinements:
+            break
+        # Subdivide the cubes in the Morse sets and compute the images of the new cubes
+        morse_cells = [morse_decomp.morseset(v) for v in range(morse_decomp.poset().size())]
+        morse_cells = np.concatenate(morse_cells) if morse_cells else []
+        new_indices, children = cubical_complex.subdivide(morse_cells)
+        F_boxes = np.vstack([F_boxes[new_indices >= 0], cube_images(cubical_complex, model, children)])
+    # Get number of Morse graph nodes
+    num_nodes = morse_decomp.poset().size()
+    # Create an indexing of the Morse graph vertices
+    vertex_mapping = {v: num_nodes - 1 - v for v in range(num_nodes)}
+    # Construct the Morse graph and add edges
+    morse_graph = CMGDB_utils.DirectedAcyclicGraph()
+    for v in range(num_nodes):
+        morse_graph.add_vertex(vertex_mapping[v])
+    for u in range(num_nodes):
+        for v in morse_decomp.poset().children(u):
+            morse_graph.add_edge(vertex_mapping[u], vertex_mapping[v])
+    morse_graph_data = (morse_graph, morse_decomp, vertex_mapping)
+    return morse_graph_data, cubical_complex
+
+def conley_morse_graph_from_matrix(mvm, grid_size, periodic, acyclic_check=True, workers=None, conley_cache=None):
+    """Compute the Conley Morse graph of the multi-valued map given by the sparse (CSR)
+       adjacency matrix mvm. Return the Morse graph data (morse_graph, morse_decomp,
+       vertex_mapping)"""
+    digraph = digraph_from_matrix(mvm)
     # Compute Morse decomposition
     morse_decomp = DSGRN.MorseDecomposition(digraph)
     # Get number of Morse graph nodes
     num_nodes = morse_decomp.poset().size()
     # Create an indexing of the Morse graph vertices
     vertex_mapping = {v: num_nodes - 1 - v for v in range(num_nodes)}
+    # Get index pairs and restricted multi-valued maps of the Morse sets
+    index_pairs = [morse_set_index_pair(mvm, morse_decomp.morseset(v)) for v in range(num_nodes)]
+    # Compute the Conley indices (in parallel if workers > 1)
+    conley_indices = compute_conley_indices(index_pairs, grid_size, periodic, acyclic_check,
+                                            workers=workers, conley_cache=conley_cache)
     # Construct the Morse graph and add edges
     morse_graph = CMGDB_utils.DirectedAcyclicGraph()
     for v in range(num_nodes):
         # Get corresponding Morse node
         morse_node = vertex_mapping[v]
-        morse_set = set(morse_decomp.morseset(v))
-        # S subset F(S) for a Morse set. So X = F(S)
-        # X_cells = set(morse_set)
-        X_cells = set()
-        for u in morse_set:
-            X_cells.update(digraph.adjacencies(u))
-        # Define multivalued map F restricted to X
-        F = {u: [w for w in digraph.adjacencies(u) if w in X_cells] for u in X_cells}
-        A = list(X_cells - morse_set)
-        X = list(X_cells)
-        conley_index = CMGDB.ComputeConleyIndex(X, A, model.grid_size, model.periodic, F, acyclic_check)
+        conley_index = conley_indices[v]
         conley_index_str = '(' + ', '.join(conley_index) + ')' if conley_index else 'Undefined'
         morse_graph.add_vertex(morse_node, label=conley_index_str)
     for u in range(num_nodes):
         for v in morse_decomp.poset().children(u):
             morse_graph.add_edge(vertex_mapping[u], vertex_mapping[v])
     morse_graph_data = (morse_graph, morse_decomp, vertex_mapping)
+    return morse_graph_data
+
+def ComputeConleyMorseGraph(model, acyclic_check=True, workers=None, cache=None, conley_cache=None):
+    """Compute cubical complex and Conley Morse graph"""
+    # Construct the cubical complex
+    cubical_complex = CMGDB_utils.CubicalGrid(model.lower_bounds, model.upper_bounds, model.grid_size)
+    # Compute the multi-valued map as a sparse matrix
+    mvm = multivalued_map_matrix(cubical_complex, model, workers=workers, cache=cache)
+    # Compute the Morse decomposition and the Conley indices
+    morse_graph_data = conley_morse_graph_from_matrix(mvm, model.grid_size, model.periodic, acyclic_check,
+                                                      workers=workers, conley_cache=conley_cache)
     return morse_graph_data, cubical_complex
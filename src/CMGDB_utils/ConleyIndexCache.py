@@ -0,0 +1,74 @@
+### ConleyIndexCache.py
+### MIT LICENSE 2026 Marcio Gameiro
+
+import CMGDB
+
+import numpy as np
+import hashlib
+import json
+import os
+
+class ConleyIndexCache:
+    """Content-addressed cache of Conley index computations. The Conley index of an
+       index pair (X, A) is stored under a hash of the sorted X and A cells, the map F
+       restricted to X, the grid size, the periodicity and the acyclic_check flag, so
+       identical index pairs are computed only once. The results are kept in memory
+       and also saved as JSON files in cache_dir if given. Index pairs with less than
+       min_size cells in X are computed directly without hashing."""
+
+    def __init__(self, cache_dir=None, min_size=16):
+        self.cache_dir = cache_dir
+        self.min_size = min_size
+        self.conley_indices = {}
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, X, A, grid_size, periodic, F, acyclic_check):
+        """Return the cache key of the index pair (X, A)"""
+        X = np.sort(np.asarray(X, dtype=np.int64))
+        A = np.sort(np.asarray(A, dtype=np.int64))
+        # Adjacency lists of F in the order of X
+        F_lens = np.array([len(F[u]) for u in X.tolist()], dtype=np.int64)
+        F_adjs = np.array([w for u in X.tolist() for w in sorted(F[u])], dtype=np.int64)
+        params = json.dumps([[int(n) for n in grid_size], [bool(p) for p in periodic], bool(acyclic_check)])
+        hash_obj = hashlib.sha256(params.encode())
+        for array in [X, A, F_lens, F_adjs]:
+            hash_obj.update(np.int64(len(array)).tobytes())
+            hash_obj.update(array.tobytes())
+        return hash_obj.hexdigest()
+
+    def get(self, X, A, grid_size, periodic, F, acyclic_check=True):
+        """Return the key of the index pair (X, A) and its Conley index or None if not
+           in the cache. The key is None if the index pair is smaller than min_size."""
+        if len(X) < self.min_size:
+            return None, None
+        key = self.key(X, A, grid_size, periodic, F, acyclic_check)
+        if key in self.conley_indices:
+            return key, self.conley_indices[key]
+        fname = os.path.join(self.cache_dir, key + '.json') if self.cache_dir is not None else None
+        if fname is not None and os.path.isfile(fname):
+            with open(fname, 'r') as json_file:
+                self.conley_indices[key] = json.load(json_file)
+            return key, self.conley_indices[key]
+        return key, None
+
+    def put(self, key, conley_index):
+        """Store the Conley index with the given key"""
+        if key is None:
+            return
+        self.conley_indices[key] = conley_index
+        if self.cache_dir is not None:
+            # Write to a temporary file first so files are never partially written
+            fname = os.path.join(self.cache_dir, key + '.json')
+            tmp_fname = fname + '.tmp' + str(os.getpid())
+            with open(tmp_fname, 'w') as json_file:
+                json.dump(list(conley_index), json_file)
+            os.replace(tmp_fname, fname)
+
+    def compute(self, X, A, grid_size, periodic, F, acyclic_check=True):
+        """Return the Conley index of the index pair (X, A). Same arguments as CMGDB.ComputeConleyIndex"""
+        key, conley_index = self.get(X, A, grid_size, periodic, F, acyclic_check)
+        if conley_index is None:
+            conley_index = CMGDB.ComputeConleyIndex(X, A, grid_size, periodic, F, acyclic_check)
+            self.put(key, conley_index)
+        return conley_index
@@ -58,6 +58,20 @@ class CubicalGrid:
         max_vert = [self.lower_bounds[k] + (coords[k] + 1) * self.cube_sizes[k] for k in range(self.dim)]
         return max_vert
 
+    def min_vertices(self, indices):
+        """Return an (N, dim) array of real coordinates of the minimum vertices"""
+        coords = np.column_stack(self.coordinates(np.asarray(indices)))
+        return np.asarray(self.lower_bounds) + coords * np.asarray(self.cube_sizes)
+
+    def max_vertices(self, indices):
+        """Return an (N, dim) array of real coordinates of the maximum vertices"""
+        coords = np.column_stack(self.coordinates(np.asarray(indices)))
+        return np.asarray(self.lower_bounds) + (coords + 1) * np.asarray(self.cube_sizes)
+
+    def boxes(self, indices):
+        """Return an (N, 2*dim) array of rectangles (min vertex + max vertex) of the cubes"""
+        return np.hstack([self.min_vertices(indices), self.max_vertices(indices)])
+
     def grid_cover(self, box, padding=False):
         """Return"""
         # Get box lower and upper bounds
@@ -83,3 +97,52 @@ class CubicalGrid:
         # Get set of indices of cubes covering the box
         cover_indices = {self.index(coords) for coords in itertools.product(*coord_ranges)}
         return cover_indices
+
+    def cover_coordinate_ranges(self, boxes, padding=False):
+        """Return the (N, dim) arrays min_coords and max_coords of the integer coordinates
+           of the cubes covering each box of an (N, 2*dim) array of boxes, that is, the
+           cover of the k-th box is the range min_coords[k] to max_coords[k] (inclusive)
+           in each dimension. The ranges of the boxes outside the domain are empty."""
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 2 * self.dim)
+        lower_bounds = np.asarray(self.lower_bounds, dtype=float)
+        upper_bounds = np.asarray(self.upper_bounds, dtype=float)
+        cube_sizes = np.asarray(self.cube_sizes, dtype=float)
+        grid_size = np.asarray(self.grid_size, dtype=np.int64)
+        # Get boxes lower and upper bounds
+        box_lower_bounds = boxes[:, :self.dim]
+        box_upper_bounds = boxes[:, self.dim:]
+        # Check which boxes are outside the domain
+        outside = np.any(box_upper_bounds < lower_bounds, axis=1) | np.any(box_lower_bounds > upper_bounds, axis=1)
+        # Get min and max coordinate for each dimension as in grid_cover
+        min_coords = np.ceil((box_lower_bounds - lower_bounds) / cube_sizes).astype(np.int64) - 1
+        max_coords = np.floor((box_upper_bounds - lower_bounds) / cube_sizes).astype(np.int64)
+        # Pad by one layer of cubes if requested and make sure coordinates are in [0, grid_size)
+        pad = 1 if padding else 0
+        min_coords = np.maximum(min_coords - pad, 0)
+        max_coords = np.minimum(max_coords + pad, grid_size - 1)
+        max_coords[outside] = min_coords[outside] - 1
+        return min_coords, max_coords
+
+    def grid_cover_batch(self, boxes, padding=False):
+        """Return the cubes covering each box of an (N, 2*dim) array of boxes in CSR
+           form, that is, a pair (offsets, indices) of flat arrays where the indices
+           of the cubes covering the k-th box are indices[offsets[k]:offsets[k + 1]]"""
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 2 * self.dim)
+        num_boxes = boxes.shape[0]
+        min_coords, max_coords = self.cover_coordinate_ranges(boxes, padding=padding)
+        # Number of cubes along each dimension and in total for each box
+        num_coords = np.maximum(max_coords - min_coords + 1, 0)
+        num_cover = np.prod(num_coords, axis=1)
+        offsets = np.zeros(num_boxes + 1, dtype=np.int64)
+        np.cumsum(num_cover, out=offsets[1:])
+        # Box of each cover element and its position inside the box cover
+        box_ids = np.repeat(np.arange(num_boxes), num_cover)
+        positions = np.arange(offsets[-1], dtype=np.int64) - offsets[box_ids]
+        # Decompose positions into integer coordinates (first dimension varies fastest)
+        coords = []
+        for k in range(self.dim):
+            n_k = num_coords[box_ids, k]
+            coords.append(min_coords[box_ids, k] + positions % n_k)
+            positions = positions // n_k
+        indices = np.ravel_multi_index(coords, self.grid_size, order='F')
+        return offsets, indices
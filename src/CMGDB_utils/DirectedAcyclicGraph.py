@@ -1,45 +1,73 @@
 ### DirectedAcyclicGraph.py
 ### MIT LICENSE 2025 Marcio Gameiro
 
-import copy
+import numpy as np
+import graphviz
 
 class DirectedAcyclicGraph:
-    """Represents a directed acyclic graph"""
+    """Represents a directed acyclic graph. The vertices are indexed by the integers
+       0, 1, ..., n - 1 (in the order they are added) and the edges are stored by index
+       and compiled into a sparse (CSR) adjacency structure when needed."""
+
+    __slots__ = ('vertex_ids_', 'vertex_index_', 'vertex_set_', 'vertex_labels_',
+                 'edge_labels_', 'indptr_', 'indices_')
 
     def __init__(self):
         """Initialize an empty graph object"""
-        self.vertices_ = set()
-        self.adjacency_lists_ = {}
-        self.vertex_labels_ = {}
+        self.vertex_ids_ = []
+        self.vertex_index_ = {}
+        self.vertex_set_ = set()
+        self.vertex_labels_ = []
+        # Edge labels indexed by pairs of vertex indices
         self.edge_labels_ = {}
+        # Adjacency structure in CSR form (None if out of date)
+        self.indptr_ = None
+        self.indices_ = None
 
     def add_vertex(self, v, label=''):
         """Add the vertex v to the graph and associate a label if one is given"""
-        if v in self.vertices_: return
-        self.vertices_.add(v)
-        self.adjacency_lists_[v] = set()
-        self.vertex_labels_[v] = label
-        self.edge_labels_[v] = {}
+        if v in self.vertex_index_: return
+        self.vertex_index_[v] = len(self.vertex_ids_)
+        self.vertex_ids_.append(v)
+        self.vertex_set_.add(v)
+        self.vertex_labels_.append(label)
+        self.indptr_ = None
 
     def add_edge(self, u, v, label=''):
         """Add the edge u -> v to the graph and associate a label if one is given"""
         self.add_vertex(u)
         self.add_vertex(v)
-        self.adjacency_lists_[u].add(v)
-        self.edge_labels_[u][v] = label
+        edge = (self.vertex_index_[u], self.vertex_index_[v])
+        if edge not in self.edge_labels_:
+            self.indptr_ = None
+        self.edge_labels_[edge] = label
 
     def remove_edge(self, u, v):
         """Remove the edge u -> v from the graph"""
-        self.adjacency_lists_[u].discard(v)
-        self.edge_labels_[u].pop(v, None)
+        edge = (self.vertex_index_[u], self.vertex_index_.get(v))
+        if edge in self.edge_labels_:
+            del self.edge_labels_[edge]
+            self.indptr_ = None
+
+    def csr(self):
+        """Return the adjacency structure (indptr, indices) in CSR form, that is, the
+           indices of the adjacencies of the vertex of index i are indices[indptr[i]:indptr[i + 1]]"""
+        if self.indptr_ is None:
+            num_verts = len(self.vertex_ids_)
+            edges = np.array(list(self.edge_labels_), dtype=np.int64).reshape(-1, 2)
+            edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+            self.indptr_ = np.zeros(num_verts + 1, dtype=np.int64)
+            np.cumsum(np.bincount(edges[:, 0], minlength=num_verts), out=self.indptr_[1:])
+            self.indices_ = edges[:, 1]
+        return self.indptr_, self.indices_
 
     def vertex_label(self, v):
         """Return the label on the vertex v"""
-        return self.vertex_labels_[v]
+        return self.vertex_labels_[self.vertex_index_[v]]
 
     def get_vertex_from_label(self, label):
         """Return the vertex v with label 'label'. Error if non-unique"""
-        vertices = [v for v in self.vertices_ if self.vertex_label(v) == label]
+        vertices = [v for v in self.vertex_set_ if self.vertex_label(v) == label]
         N = len(vertices)
         if N == 1:
             return vertices[0]
@@ -50,11 +78,11 @@ class DirectedAcyclicGraph:
 
     def edge_label(self, u, v):
         """Return the label on the edge u -> v"""
-        return self.edge_labels_[u][v]
+        return self.edge_labels_[(self.vertex_index_[u], self.vertex_index_[v])]
 
     def vertices(self):
         """Return the set of vertices in the graph"""
-        return self.vertices_
+        return self.vertex_set_
 
     def edges(self):
         """Return a complete list of directed edges (u,v) in the graph"""
@@ -62,27 +90,129 @@ class DirectedAcyclicGraph:
 
     def adjacencies(self, v):
         """Return the set of adjacencies of v, i.e. { u : v -> u }"""
-        return self.adjacency_lists_[v]
+        i = self.vertex_index_[v]
+        indptr, indices = self.csr()
+        return {self.vertex_ids_[j] for j in indices[indptr[i]:indptr[i + 1]].tolist()}
+
+    def empty_copy(self):
+        """Return a graph with the same vertices (and labels) and no edges"""
+        G = DirectedAcyclicGraph.__new__(DirectedAcyclicGraph)
+        G.vertex_ids_ = list(self.vertex_ids_)
+        G.vertex_index_ = dict(self.vertex_index_)
+        G.vertex_set_ = set(self.vertex_set_)
+        G.vertex_labels_ = list(self.vertex_labels_)
+        G.edge_labels_ = {}
+        G.indptr_ = None
+        G.indices_ = None
+        return G
 
     def clone(self):
-        """Return a copy of this graph"""
-        return copy.deepcopy(self)
+        """Return a copy of this graph with the same vertex and edge labels"""
+        G = self.empty_copy()
+        G.edge_labels_ = dict(self.edge_labels_)
+        # The CSR arrays are never modified in place so they can be shared
+        G.indptr_ = self.indptr_
+        G.indices_ = self.indices_
+        return G
 
     def transpose(self):
         """Return a new graph with edge direction reversed"""
-        G = DirectedAcyclicGraph ()
-        for v in self.vertices(): G.add_vertex(v,self.vertex_label(v))
-        for (u,v) in self.edges(): G.add_edge(v,u,self.edge_label(u,v))
+        G = self.empty_copy()
+        G.edge_labels_ = {(j, i): label for (i, j), label in self.edge_labels_.items()}
+        return G
+
+    def topological_order(self):
+        """Return the list of vertex indices in topological order, that is, each vertex
+           comes before its adjacencies. Self loops are ignored."""
+        indptr, indices = self.csr()
+        num_verts = len(self.vertex_ids_)
+        sources = np.repeat(np.arange(num_verts), np.diff(indptr))
+        # Number of incoming edges of each vertex
+        in_degree = np.bincount(indices[indices != sources], minlength=num_verts).tolist()
+        indptr = indptr.tolist()
+        indices = indices.tolist()
+        order = [i for i in range(num_verts) if in_degree[i] == 0]
+        for i in order:
+            for j in indices[indptr[i]:indptr[i + 1]]:
+                if j == i:
+                    continue
+                in_degree[j] -= 1
+                if in_degree[j] == 0:
+                    order.append(j)
+        if len(order) < num_verts:
+            raise ValueError("The graph has a cycle")
+        return order
+
+    def topological_sort(self):
+        """Return the list of vertices in topological order (each vertex comes before its adjacencies)"""
+        return [self.vertex_ids_[i] for i in self.topological_order()]
+
+    def reachability_bitsets(self):
+        """Return the list of descendants (excluding itself) of each vertex index as
+           bitsets, that is, bit j of the i-th bitset is set if j is reachable from i"""
+        indptr, indices = self.csr()
+        indptr = indptr.tolist()
+        indices = indices.tolist()
+        reachable = [0] * len(self.vertex_ids_)
+        # Process vertices after their adjacencies
+        for i in reversed(self.topological_order()):
+            bits = 0
+            for j in indices[indptr[i]:indptr[i + 1]]:
+                if j != i:
+                    bits |= reachable[j] | (1 << j)
+            reachable[i] = bits
+        return reachable
+
+    def transitive_closure(self):
+        """Return a new graph which is the transitive closure"""
+        G = self.empty_copy()
+        for i, bits in enumerate(self.reachability_bitsets()):
+            while bits:
+                low_bit = bits & -bits
+                bits ^= low_bit
+                j = low_bit.bit_length() - 1
+                G.edge_labels_[(i, j)] = self.edge_labels_.get((i, j), '')
+        return G
+
+    def transitive_reduction(self):
+        """Return a new graph which is the transitive reduction"""
+        G = self.empty_copy()
+        reachable = self.reachability_bitsets()
+        indptr, indices = self.csr()
+        indptr = indptr.tolist()
+        indices = indices.tolist()
+        for i in range(len(self.vertex_ids_)):
+            adjacencies = [j for j in indices[indptr[i]:indptr[i + 1]] if j != i]
+            # Vertices reachable through a path of length at least two
+            indirect = 0
+            for j in adjacencies:
+                indirect |= reachable[j]
+            for j in adjacencies:
+                if not (indirect >> j) & 1:
+                    G.edge_labels_[(i, j)] = self.edge_labels_[(i, j)]
         return G
 
     def descendants(self, v):
         """Find vertices reachable from from v"""
-        reachable = set([v])
-        workstack = [v]
+        i = self.vertex_index_[v]
+        indptr, indices = self.csr()
+        reachable = {i}
+        workstack = [i]
         while workstack:
-            u = workstack.pop()
-            for w in self.adjacencies(u):
-                if w not in reachable:
-                    workstack.append(w)
-                    reachable.add(w)
-        return reachable
+            k = workstack.pop()
+            for j in indices[indptr[k]:indptr[k + 1]].tolist():
+                if j not in reachable:
+                    workstack.append(j)
+                    reachable.add(j)
+        return {self.vertex_ids_[j] for j in reachable}
+
+    def graphviz(self):
+        """Return a graphviz string describing the graph and its labels"""
+        gv = 'digraph {\n'
+        indices = {v: str(k) for k, v in enumerate(self.vertices())}
+        for v in self.vertices(): gv += indices[v] + '[label="' + self.vertex_label(v) + '"];\n'
+        for (u,v) in self.edges(): gv += indices[u] + ' -> ' + indices[v] + ' [label="' + self.edge_label(u,v) + '"];\n'
+        return gv + '}\n'
+
+    def _repr_svg_(self):
+        return graphviz.Source(self.graphviz())._repr_svg_()
@@ -1,24 +1,24 @@
 ### LatticeAttractors.py
 ### MIT LICENSE 2025 Marcio Gameiro
 
-import pychomp
-import functools
+import CMGDB_utils
 import itertools
 
+def directed_acyclic_graph(graph):
+    """Return graph if it is a CMGDB_utils.DirectedAcyclicGraph or a
+       copy of its vertices and edges as a DirectedAcyclicGraph"""
+    if isinstance(graph, CMGDB_utils.DirectedAcyclicGraph):
+        return graph
+    graph_new = CMGDB_utils.DirectedAcyclicGraph()
+    for v in graph.vertices():
+        graph_new.add_vertex(v)
+    for v1, v2 in graph.edges():
+        graph_new.add_edge(v1, v2)
+    return graph_new
+
 def transitive_closure(morse_graph):
     """Compute the transitive closure of Morse graph"""
-    # First create a pychomp version of Morse graph
-    morse_graph_new = pychomp.DirectedAcyclicGraph()
-    for v in morse_graph.vertices():
-        # # Handle the case of annotations not present
-        # annotations = getattr(morse_graph, 'annotations', [])
-        # v_label = str(tuple(annotations(v))) if annotations else morse_graph.vertex_label(v)
-        # morse_graph_new.add_vertex(v, label=v_label)
-        morse_graph_new.add_vertex(v)
-    for v1, v2 in morse_graph.edges():
-        morse_graph_new.add_edge(v1, v2)
-    # Return the transitive closure of Morse graph
-    return morse_graph_new.transitive_closure()
+    return directed_acyclic_graph(morse_graph).transitive_closure()
 
 def morse_graph_attractors_slow(morse_graph):
     """Compute all attractors from Morse graph. This is a slow (direct)
@@ -76,95 +76,200 @@ def cmp_func(A1, A2):
     # Compare by length (includes order relation)
     return -1 if len(A1) < len(A2) else 1
 
+def downset_bitmasks(morse_graph):
+    """Return the list of Morse nodes in a topological order (children first) and the
+       lists of bitmasks of the down set and up set of each node, where the k-th bit
+       corresponds to the k-th node in the list of Morse nodes"""
+    graph = directed_acyclic_graph(morse_graph)
+    # Reverse of the topological order (every node comes after its children)
+    nodes = graph.topological_sort()[::-1]
+    bit_index = {v: k for k, v in enumerate(nodes)}
+    # Down set of v is {v} union with the down sets of its children
+    down_masks = [0] * len(nodes)
+    for k, v in enumerate(nodes):
+        mask = 1 << k
+        for w in graph.adjacencies(v):
+            mask |= down_masks[bit_index[w]]
+        down_masks[k] = mask
+    # Up set of v is {v} union with the up sets of its parents
+    up_masks = [1 << k for k in range(len(nodes))]
+    for k in reversed(range(len(nodes))):
+        for w in graph.adjacencies(nodes[k]):
+            up_masks[bit_index[w]] |= up_masks[k]
+    return nodes, down_masks, up_masks
+
+def bitmask_nodes(mask, nodes):
+    """Return the list of Morse nodes in the set represented by the bitmask"""
+    set_nodes = []
+    while mask:
+        low_bit = mask & -mask
+        set_nodes.append(nodes[low_bit.bit_length() - 1])
+        mask ^= low_bit
+    return set_nodes
+
+def downset_bitmasks_iter(up_masks):
+    """Generate the bitmasks of all down sets (attractors). The nodes are given
+       in a topological order (children first) by the list of up set bitmasks.
+       Each node is either added to the down set or excluded together with its
+       up set, so every branch of the search gives a distinct down set."""
+    num_nodes = len(up_masks)
+    # Stack of (node position, down set, excluded nodes)
+    workstack = [(0, 0, 0)]
+    while workstack:
+        k, downset, excluded = workstack.pop()
+        # Skip the nodes excluded because one of their children was excluded
+        while k < num_nodes and (excluded >> k) & 1:
+            k += 1
+        if k == num_nodes:
+            yield downset
+            continue
+        # Exclude node k and its up set or add node k to the down set
+        workstack.append((k + 1, downset, excluded | up_masks[k]))
+        workstack.append((k + 1, downset | (1 << k), excluded))
+
 def morse_graph_attractors(morse_graph):
     """Compute all attractors from Morse graph"""
-    # Compute the transitive closure of Morse graph
-    mg_trans_closure = transitive_closure(morse_graph)
-    # Store attractors as a set of frozensets
-    elementary_attractors = {frozenset()}
-    # Find elementary attractors (downsets of a node)
-    for v in morse_graph.vertices():
-        descendants = mg_trans_closure.adjacencies(v)
-        # The down set of v is {v} union with its decendents
-        elementary_attractors.add(frozenset({v} | descendants))
-    # Compute all joins to get all attractors
-    attractors = elementary_attractors.copy()
-    attractors_list = list(elementary_attractors)
-    for k1 in range(len(attractors_list)):
-        combos = set()
-        A1 = attractors_list[k1]
-        for k2 in range(k1 + 1, len(attractors_list)):
-            A2 = attractors_list[k2]
-            if comparable(A1, A2):
-                continue
-            # New combo if A1 and A2 not comparable
-            new_combos = {frozenset({A1, A2})}
-            for combo in combos:
-                # Add A2 to combo if not comparable with its elements
-                if not any(comparable(A2, A3) for A3 in combo):
-                    new_combos.add(frozenset({A2} | combo))
-            # Update set of combos
-            combos.update(new_combos)
-        # Add union of each combo obtained from A1 = attractors_list[k1]
-        attractors.update({frozenset.union(*combo) for combo in combos})
+    # Encode down sets of Morse nodes as bitmasks
+    nodes, down_masks, up_masks = downset_bitmasks(morse_graph)
+    # Enumerate the lattice of down sets (attractors)
+    attractors = {frozenset(bitmask_nodes(mask, nodes)) for mask in downset_bitmasks_iter(up_masks)}
     return attractors
 
+def attractors_iter(morse_graph, contains=(), excludes=(), max_size=None, bitmasks=False):
+    """Generate the attractors of Morse graph in the order of the lattice of attractors
+       (by size and lexicographical order) without computing the lattice graph. Only
+       the attractors containing the Morse nodes in contains, not containing the Morse
+       nodes in excludes and with at most max_size nodes are generated. The attractors
+       are given as sorted tuples of Morse nodes, or as bitmasks where bit v corresponds
+       to Morse node v if bitmasks is True. The attractors of each size are generated
+       (and sorted) together, so the memory used is proportional to the number of
+       attractors of two consecutive sizes, which can be exponential in the number of
+       Morse nodes (for example if the Morse nodes are not comparable)."""
+    nodes, down_masks, up_masks = downset_bitmasks(morse_graph)
+    bit_index = {v: k for k, v in enumerate(nodes)}
+    # Smallest attractor and excluded nodes
+    min_mask = 0
+    for v in contains:
+        min_mask |= down_masks[bit_index[v]]
+    excluded = 0
+    for v in excludes:
+        excluded |= up_masks[bit_index[v]]
+    if min_mask & excluded:
+        return
+    # Generate the attractors one size at a time (as a set of bitmasks)
+    attractor_nodes = lambda mask: tuple(sorted(bitmask_nodes(mask, nodes)))
+    level = {min_mask}
+    size = bin(min_mask).count('1')
+    while level and (max_size is None or size <= max_size):
+        next_level = set()
+        for mask in sorted(level, key=attractor_nodes):
+            attractor = attractor_nodes(mask)
+            yield sum(1 << v for v in attractor) if bitmasks else attractor
+            # Add a node whose children are all in the attractor
+            for k in range(len(nodes)):
+                low_bit = 1 << k
+                if (mask | excluded) & low_bit or (down_masks[k] & ~mask) != low_bit:
+                    continue
+                next_level.add(mask | low_bit)
+        level = next_level
+        size += 1
+
+def count_attractors(morse_graph, contains=(), excludes=()):
+    """Count the attractors of Morse graph containing the Morse nodes in contains and
+       not containing the Morse nodes in excludes without enumerating them. The number
+       of down sets of a set S of nodes is computed by the recursion
+       f(S) = f(S - up(x)) + f(S - down(x)) for x in S, splitting S in components."""
+    nodes, down_masks, up_masks = downset_bitmasks(morse_graph)
+    bit_index = {v: k for k, v in enumerate(nodes)}
+    # Smallest attractor and excluded nodes
+    min_mask = 0
+    for v in contains:
+        min_mask |= down_masks[bit_index[v]]
+    excluded = 0
+    for v in excludes:
+        excluded |= up_masks[bit_index[v]]
+    if min_mask & excluded:
+        return 0
+    # Nodes comparable to each node
+    comparable_masks = [down_masks[k] | up_masks[k] for k in range(len(nodes))]
+    num_downsets = {0: 1}
+
+    def components(mask):
+        """Split the set of nodes mask into connected components"""
+        while mask:
+            component = mask & -mask
+            frontier = component
+            while frontier:
+                low_bit = frontier & -frontier
+                frontier ^= low_bit
+                new_nodes = comparable_masks[low_bit.bit_length() - 1] & mask & ~component
+                component |= new_nodes
+                frontier |= new_nodes
+            mask &= ~component
+            yield component
+
+    def count(mask):
+        """Count the down sets of the set of nodes mask"""
+        if mask in num_downsets:
+            return num_downsets[mask]
+        total = 1
+        for component in components(mask):
+            if component not in num_downsets:
+                # Split on the node comparable to most nodes of the component
+                bits = [k for k in range(len(nodes)) if (component >> k) & 1]
+                k = max(bits, key=lambda k: bin(comparable_masks[k] & component).count('1'))
+                num_downsets[component] = count(component & ~up_masks[k]) + count(component & ~down_masks[k])
+            total *= num_downsets[component]
+        num_downsets[mask] = total
+        return total
+
+    all_nodes = (1 << len(nodes)) - 1
+    return count(all_nodes & ~min_mask & ~excluded)
+
+def downset_lattice(morse_graph, reverse=False):
+    """Compute the lattice of down sets of Morse graph as an acyclic graph with the down sets
+       sorted by size and lexicographical order (reversed if reverse is True). The edges are
+       the covering relations, that is, a down set covers the down sets obtained by removing
+       one of its maximal nodes. The edges go from larger to smaller down sets, or from
+       smaller to larger down sets if reverse is True."""
+    # Encode down sets of Morse nodes as bitmasks
+    nodes, down_masks, up_masks = downset_bitmasks(morse_graph)
+    # Enumerate the lattice of down sets
+    downsets = {mask: sorted(bitmask_nodes(mask, nodes)) for mask in downset_bitmasks_iter(up_masks)}
+    # Get a sorted list of down sets
+    sorted_masks = sorted(downsets, key=lambda mask: (len(downsets[mask]), downsets[mask]), reverse=reverse)
+    vertex_index = {mask: v for v, mask in enumerate(sorted_masks)}
+    # Compute lattice of down sets as an acyclic graph
+    lattice = CMGDB_utils.DirectedAcyclicGraph()
+    # Create vertices (indexing of the set of down sets)
+    for v, mask in enumerate(sorted_masks):
+        D = downsets[mask]
+        vertex_label = '{' + (str(D)[1:-1] if D else ' ') + '}'
+        lattice.add_vertex(v, label=vertex_label)
+    # Add edges corresponding to the covering relation
+    for mask in sorted_masks:
+        bits = mask
+        while bits:
+            low_bit = bits & -bits
+            bits ^= low_bit
+            k = low_bit.bit_length() - 1
+            # Node k is maximal if no other node of its up set is in the down set
+            if up_masks[k] & mask != low_bit:
+                continue
+            if reverse:
+                lattice.add_edge(vertex_index[mask ^ low_bit], vertex_index[mask])
+            else:
+                lattice.add_edge(vertex_index[mask], vertex_index[mask ^ low_bit])
+    return lattice
+
 def lattice_attractors(morse_graph):
     """Compute lattice of attractors from Morse graph"""
-    # Compute list of Morse graph attractors
-    attractors = morse_graph_attractors(morse_graph)
-    # Compute lattice of attractors as an acyclic graph
-    lattice_att = pychomp.DirectedAcyclicGraph()
-    # Get a sorted list of attractors
-    sorted_attractors = sorted(map(set, attractors), key=functools.cmp_to_key(cmp_func))
-    # sorted_attractors = sorted([set(A) for A in attractors], key=functools.cmp_to_key(cmp_func))
-    # Create vertices (indexing of the set of attractors)
-    vertices = range(len(sorted_attractors))
-    for v in vertices:
-        A = sorted_attractors[v]
-        vertex_label = '{' + (str(sorted(A))[1:-1] if A else ' ') + '}'
-        # vertex_label = str(set(sorted(A))) if A else '{ }'
-        # vertex_label = str(A) if A else '{ }'
-        lattice_att.add_vertex(v, label=vertex_label)
-    # Add edges corresponding to the partial order
-    for v1 in vertices:
-        A1 = sorted_attractors[v1]
-        for v2 in vertices:
-            A2 = sorted_attractors[v2]
-            # Add edge if A1 < A2 (A1 subset A2)
-            if A1.issubset(A2) and A1 != A2:
-                lattice_att.add_edge(v2, v1)
-    return lattice_att.transitive_reduction()
+    # Attractors are the down sets of the Morse graph
+    return downset_lattice(morse_graph)
 
 def lattice_repellers(morse_graph):
     """Compute lattice of repellers from Morse graph"""
     # Get the transpose of the Morse graph
-    morse_graph_transpose = pychomp.DirectedAcyclicGraph()
-    for v in morse_graph.vertices():
-        morse_graph_transpose.add_vertex(v)
-    for v1, v2 in morse_graph.edges():
-        morse_graph_transpose.add_edge(v2, v1)
-    # Compute list attractors for transposed morse graph
-    repellers = morse_graph_attractors(morse_graph_transpose)
-    # Compute lattice of repellers as an acyclic graph
-    lattice_rep = pychomp.DirectedAcyclicGraph()
-    # Get a sorted list of repellers
-    sorted_repellers = sorted(map(set, repellers), key=functools.cmp_to_key(cmp_func), reverse=True)
-    # sorted_repellers = sorted([set(R) for R in repellers], key=functools.cmp_to_key(cmp_func), reverse=True)
-    # Create vertices (indexing of the set of repellers)
-    vertices = range(len(sorted_repellers))
-    for v in vertices:
-        R = sorted_repellers[v]
-        vertex_label = '{' + (str(sorted(R))[1:-1] if R else ' ') + '}'
-        # vertex_label = str(set(sorted(R))) if R else '{ }'
-        # vertex_label = str(R) if R else '{ }'
-        lattice_rep.add_vertex(v, label=vertex_label)
-    # Add edges corresponding to the partial order
-    for v1 in vertices:
-        R1 = sorted_repellers[v1]
-        for v2 in vertices:
-            R2 = sorted_repellers[v2]
-            # Add edge if R1 < R2 (R2 subset R1)
-            if R2.issubset(R1) and R1 != R2:
-                lattice_rep.add_edge(v2, v1)
-    return lattice_rep.transitive_reduction()
+    morse_graph_transpose = directed_acyclic_graph(morse_graph).transpose()
+    # Repellers are the down sets of the transposed Morse graph
+    return downset_lattice(morse_graph_transpose, reverse=True)
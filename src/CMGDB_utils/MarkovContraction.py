@@ -1,5 +1,6 @@
 from collections import defaultdict
 import numpy as np
+import scipy
 
 def average_rows_inplace(W, rows):
     rows_set = set(rows)
@@ -63,16 +64,69 @@ def contract_markov_matrix(W, indices):
     average_rows_inplace(W, indices)
     add_cols_inplace(W, indices)
 
+def aggregation_matrix(morse_sets, num_cells):
+    """Return the sparse (CSR) num_cells x num_blocks aggregation matrix P of the partition
+       of the cells into blocks, where the first blocks are the Morse sets (in order) and
+       the remaining blocks are the cells in no Morse set (in increasing order), and the
+       array of block representatives (first cell of each block)"""
+    block_of_cell = np.full(num_cells, -1, dtype=np.int64)
+    representatives = []
+    for i, morse_set in enumerate(morse_sets):
+        block_of_cell[np.asarray(morse_set, dtype=np.int64)] = i
+        representatives.append(morse_set[0])
+    # Cells in no Morse set are singleton blocks
+    other_cells = np.flatnonzero(block_of_cell < 0)
+    block_of_cell[other_cells] = len(morse_sets) + np.arange(len(other_cells))
+    representatives = np.concatenate([np.array(representatives, dtype=np.int64), other_cells])
+    num_blocks = len(representatives)
+    P = scipy.sparse.csr_matrix((np.ones(num_cells), (np.arange(num_cells), block_of_cell)),
+                                shape=(num_cells, num_blocks))
+    return P, representatives
+
+def contract_morse_sets(W, morse_sets):
+    """Contract all the Morse sets of the sparse weighted adjacency matrix W at once. The
+       rows of each Morse set are averaged and the columns are added, that is, the quotient
+       matrix is Q = D^-1 P^T W P, where P is the aggregation matrix (see aggregation_matrix)
+       and D the diagonal matrix of block sizes. Return the self weights of the Morse sets,
+       the quotient matrix Q (CSR) and the block representatives."""
+    W = scipy.sparse.csr_matrix(W)
+    P, representatives = aggregation_matrix(morse_sets, W.shape[0])
+    block_sizes = np.asarray(P.sum(axis=0)).ravel()
+    Q = scipy.sparse.diags(1.0 / block_sizes) @ (P.T @ W @ P)
+    Q = scipy.sparse.csr_matrix(Q)
+    Q.eliminate_zeros()
+    Q.sort_indices()
+    self_weights = Q.diagonal()[:len(morse_sets)]
+    return self_weights, Q, representatives
+
+def weight_matrix(W, num_cells=0):
+    """Return the weighted adjacency matrix W (sparse, dense or dict) as a sparse (CSR)
+       matrix. If W is a dict of weights indexed by pairs of cells the matrix has at
+       least num_cells rows."""
+    if scipy.sparse.issparse(W) or isinstance(W, np.ndarray):
+        return scipy.sparse.csr_matrix(W)
+    if not isinstance(W, dict):
+        raise TypeError("The weighted adjacency matrix W must be a sparse matrix, an array or a dict")
+    num_cells = max(num_cells, 1 + max([max(key) for key in W], default=-1))
+    rows = np.array([i for i, j in W], dtype=np.int64)
+    cols = np.array([j for i, j in W], dtype=np.int64)
+    return scipy.sparse.csr_matrix((np.array(list(W.values()), dtype=float), (rows, cols)),
+                                   shape=(num_cells, num_cells))
+
 def morse_set_self_weights(morse_decomp, W):
-    W = W.copy()
+    """Return the self weights of the Morse sets and the contracted matrix, that is, the
+       quotient matrix indexed by the block representatives (see contract_morse_sets).
+       The matrix W can be sparse or a dict, and the contracted matrix has the same type."""
     num_nodes = morse_decomp.poset().size()
-    self_weights = np.zeros(num_nodes) # collect the diagonal elements/self weights of the contracted matrix
-    for i in range(num_nodes):
-        # contract
-        morse_set_boxes = morse_decomp.morseset(i)
-        contract_markov_matrix(W, morse_set_boxes)
-
-        # get self edge
-        index_box = morse_set_boxes[0]
-        self_weights[i] = W[(index_box, np.int64(index_box))]
-    return self_weights, W
\ No newline at end of file
+    morse_sets = [morse_decomp.morseset(i) for i in range(num_nodes)]
+    num_cells = 1 + max([max(morse_set) for morse_set in morse_sets], default=-1)
+    W_sparse = weight_matrix(W, num_cells)
+    self_weights, Q, representatives = contract_morse_sets(W_sparse, morse_sets)
+    # Index the quotient matrix by the block representatives
+    Q = Q.tocoo()
+    W_contracted = scipy.sparse.csr_matrix((Q.data, (representatives[Q.row], representatives[Q.col])),
+                                           shape=W_sparse.shape)
+    if scipy.sparse.issparse(W):
+        return self_weights, W_contracted
+    W_contracted = W_contracted.tocoo()
+    return self_weights, dict(zip(zip(W_contracted.row.tolist(), W_contracted.col.tolist()), W_contracted.data.tolist()))
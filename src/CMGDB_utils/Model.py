@@ -2,7 +2,8 @@
 ### MIT LICENSE 2025 Marcio Gameiro
 
 class Model:
-    def __init__(self, lower_bounds, upper_bounds, grid_size, F, periodic=None, map_type='BoxMap', padding=False):
+    def __init__(self, lower_bounds, upper_bounds, grid_size, F, periodic=None, map_type='BoxMap', padding=False, batch_size=10000,
+                 map_version=None):
         self.lower_bounds = lower_bounds
         self.upper_bounds = upper_bounds
         self.grid_size = grid_size
@@ -10,4 +11,8 @@ class Model:
         self.periodic = [False]*self.dim if periodic == None else periodic
         self.map_type = map_type
         self.padding = padding
+        # Number of cubes evaluated per call of F if map_type is 'BatchBoxMap'
+        self.batch_size = batch_size
+        # Version tag of F used to cache the multi-valued map
+        self.map_version = map_version
         self.F = F
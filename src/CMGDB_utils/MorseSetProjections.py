@@ -0,0 +1,79 @@
+### MorseSetProjections.py
+### MIT LICENSE 2026 Marcio Gameiro
+
+import numpy as np
+
+class MorseSetProjections:
+    """Projections of the Morse sets of a (uniform) CubicalGrid onto pairs of dimensions. The
+       integer coordinates of the cubes of each Morse set are computed once, and the
+       projection onto the dimensions (d1, d2) maps them to the cells of the 2D grid
+       of these dimensions keeping each cell only once per Morse node. The projected
+       cells are cached so the projections can be reused (for example in pair plots)."""
+
+    def __init__(self, cubical_complex, morse_sets):
+        """The Morse sets are given as a dictionary with the cube indices of each Morse node"""
+        self.cubical_complex = cubical_complex
+        self.dim = cubical_complex.dimension()
+        self.morse_nodes = sorted(morse_sets)
+        # Integer coordinates of the cubes of each Morse set
+        self.coordinates = {}
+        for node in self.morse_nodes:
+            indices = np.asarray(morse_sets[node], dtype=np.int64)
+            coords = cubical_complex.coordinates(indices)
+            self.coordinates[node] = np.column_stack(coords).reshape(-1, self.dim).astype(np.int64)
+        self.projected_cells = {}
+
+    @classmethod
+    def from_morse_graph_data(cls, morse_graph_data, cubical_complex):
+        """Return the projections of the Morse sets of a Morse decomposition"""
+        morse_graph, morse_decomp, vertex_mapping = morse_graph_data
+        num_morse_sets = len(morse_graph.vertices())
+        morse_sets = {vertex_mapping[n]: morse_decomp.morseset(n) for n in range(num_morse_sets)}
+        return cls(cubical_complex, morse_sets)
+
+    def cells(self, d1, d2):
+        """Return a dictionary with the (M, 2) array of distinct 2D cells (integer
+           coordinates in dimensions d1 and d2) of each Morse node"""
+        if (d1, d2) not in self.projected_cells:
+            size1 = int(self.cubical_complex.get_grid_size()[d1])
+            cells = {}
+            for node, coords in self.coordinates.items():
+                # Flat index of the projected cell of each cube
+                flat_cells = np.unique(coords[:, d1] + size1 * coords[:, d2])
+                cells[node] = np.column_stack([flat_cells % size1, flat_cells // size1])
+            self.projected_cells[(d1, d2)] = cells
+        return self.projected_cells[(d1, d2)]
+
+    def rects(self, d1, d2, morse_nodes=None):
+        """Return an (N, 5) array with the rectangles (min vertex + max vertex + Morse node)
+           of the distinct projected cells of the Morse sets of morse_nodes (all if None)"""
+        if morse_nodes is None:
+            morse_nodes = self.morse_nodes
+        lower_bounds = np.asarray(self.cubical_complex.get_lower_bounds(), dtype=float)[[d1, d2]]
+        cube_sizes = np.asarray(self.cubical_complex.get_cube_sizes(), dtype=float)[[d1, d2]]
+        cells = self.cells(d1, d2)
+        rects = [np.empty((0, 5))]
+        for node in morse_nodes:
+            if node not in cells:
+                continue
+            min_verts = lower_bounds + cells[node] * cube_sizes
+            max_verts = lower_bounds + (cells[node] + 1) * cube_sizes
+            rects.append(np.hstack([min_verts, max_verts, np.full((len(min_verts), 1), node)]))
+        return np.vstack(rects)
+
+    def boxes(self, morse_nodes=None):
+        """Return an (N, 2*dim + 1) array with the rectangles (min vertex + max vertex +
+           Morse node) of the cubes of the Morse sets of morse_nodes (all if None)"""
+        if morse_nodes is None:
+            morse_nodes = self.morse_nodes
+        lower_bounds = np.asarray(self.cubical_complex.get_lower_bounds(), dtype=float)
+        cube_sizes = np.asarray(self.cubical_complex.get_cube_sizes(), dtype=float)
+        rects = [np.empty((0, 2 * self.dim + 1))]
+        for node in morse_nodes:
+            if node not in self.coordinates:
+                continue
+            coords = self.coordinates[node]
+            min_verts = lower_bounds + coords * cube_sizes
+            max_verts = lower_bounds + (coords + 1) * cube_sizes
+            rects.append(np.hstack([min_verts, max_verts, np.full((len(coords), 1), node)]))
+        return np.vstack(rects)
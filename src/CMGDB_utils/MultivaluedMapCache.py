@@ -0,0 +1,109 @@
+### MultivaluedMapCache.py
+### MIT LICENSE 2026 Marcio Gameiro
+
+import numpy as np
+import scipy
+import hashlib
+import shutil
+import json
+import os
+
+class MultivaluedMapCache:
+    """On-disk cache of multi-valued maps. Each multi-valued map is stored as the arrays
+       indptr and indices of its sparse (CSR) adjacency matrix in a directory named by a
+       hash of the model bounds, grid size, periodicity, map type, padding and version
+       tag of F (model.map_version), and loaded by memory mapping. If max_size (in bytes)
+       is given the least recently used maps are removed to keep the cache size bounded."""
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, model):
+        """Return the cache key of the multi-valued map of model"""
+        if model.map_version is None:
+            raise ValueError("A version tag map_version for F must be provided to cache the multi-valued map")
+        fingerprint = {'lower_bounds': [float(b) for b in model.lower_bounds],
+                       'upper_bounds': [float(b) for b in model.upper_bounds],
+                       'grid_size': [int(n) for n in model.grid_size],
+                       'periodic': [bool(p) for p in model.periodic],
+                       'map_type': model.map_type,
+                       'padding': bool(model.padding),
+                       'map_version': str(model.map_version)}
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        """Return the directory of the cache entry key"""
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """Return the multi-valued map with the given key or None if not in the cache"""
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+        # The entry may be evicted by another process while loading (cache miss)
+        try:
+            indptr = np.load(os.path.join(path, 'indptr.npy'), mmap_mode='r')
+            indices = np.load(os.path.join(path, 'indices.npy'), mmap_mode='r')
+            # Mark entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        num_verts = len(indptr) - 1
+        data = np.ones(len(indices), dtype=bool)
+        mvm = scipy.sparse.csr_matrix((data, indices, indptr), shape=(num_verts, num_verts), copy=False)
+        return mvm
+
+    def save(self, key, mvm):
+        """Save the multi-valued map mvm with the given key"""
+        path = self.path(key)
+        # Write to a temporary directory first so entries are never partially written
+        tmp_path = path + '.tmp' + str(os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+        # Store the indices with 32 bits if possible
+        index_dtype = np.int32 if mvm.shape[0] < 2**31 and mvm.nnz < 2**31 else np.int64
+        np.save(os.path.join(tmp_path, 'indptr.npy'), mvm.indptr.astype(index_dtype))
+        np.save(os.path.join(tmp_path, 'indices.npy'), mvm.indices.astype(index_dtype))
+        # Fails if another process saved the entry first (keep that one)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """Return a list of (last used time, size, key) of the cache entries"""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            path = self.path(key)
+            if '.tmp' in key or not os.path.isdir(path):
+                continue
+            # Skip entries removed by another process
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((os.stat(path).st_mtime, size, key))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def size(self):
+        """Return the total size (in bytes) of the cache"""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove least recently used entries until the cache size is at most max_size"""
+        if self.max_size is None:
+            return
+        entries = sorted(self.entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total_size -= size
+
+    def clear(self):
+        """Remove all entries of the cache"""
+        for _, _, key in self.entries():
+            shutil.rmtree(self.path(key), ignore_errors=True)
@@ -6,14 +6,33 @@
 import CMGDB_utils
 import pydot
 
-def NonTrivialCMGraph(morse_graph):
-    # Make a pyChomP graph from morse_graph
-    G = DirectedAcyclicGraph()
-    for v in morse_graph.vertices():
+def reduced_reachability_edges(vertices, edges, subset):
+    """Return the list of edges of the transitive reduction of the reachability relation
+       of the graph with the given vertices and edges restricted to the vertices in subset"""
+    vertices = list(vertices)
+    # Make a graph where vertex k has index k
+    G = CMGDB_utils.DirectedAcyclicGraph()
+    for v in vertices:
         G.add_vertex(v)
-    for v in morse_graph.vertices():
-        for w in morse_graph.adjacencies(v):
-            G.add_edge(v, w)
+    for v, w in edges:
+        G.add_edge(v, w)
+    # Bitsets of the vertices reachable from each vertex
+    reachable = G.reachability_bitsets()
+    subset_indices = [k for k, v in enumerate(vertices) if v in subset]
+    subset_mask = sum(1 << k for k in subset_indices)
+    indices = list(range(len(vertices)))
+    reduced_edges = []
+    for k in subset_indices:
+        below = reachable[k] & subset_mask
+        # Vertices reachable from another vertex of subset below k
+        indirect = 0
+        for j in CMGDB_utils.bitmask_nodes(below, indices):
+            indirect |= reachable[j]
+        for j in CMGDB_utils.bitmask_nodes(below & ~indirect, indices):
+            reduced_edges.append((vertices[k], vertices[j]))
+    return reduced_edges
+
+def NonTrivialCMGraph(morse_graph):
     # Space dimension
     D = len(morse_graph.annotations(0))
     # Check if a Morse node is trivial
@@ -26,29 +45,13 @@ def NonTrivialCMGraph(morse_graph):
         label = '(' + ', '.join(morse_graph.annotations(v)) + ')'
         # label = str(v) + ' : (' + ', '.join(morse_graph.annotations(v)) + ')'
         non_trivial_cmg.add_vertex(v, label=label)
-    for v in non_trivial_nodes:
-        for w in G.descendants(v):
-            if (w in non_trivial_nodes) and (w != v):
-                non_trivial_cmg.add_edge(v, w)
-    # The labels are not preserved in the transitively reduced
-    # graph. So need to remove edges from original graph.
-    # Get transitively reduced graph and its edges
-    G_reduced = non_trivial_cmg.transitive_reduction()
-    edges_reduced = G_reduced.edges()
-    # Remove transitive reducible edges
-    for (v, w) in non_trivial_cmg.edges():
-        if (v, w) not in edges_reduced:
-            non_trivial_cmg.remove_edge(v, w)
+    # Add the edges of the transitive reduction of the order restricted to nontrivial nodes
+    edges = [(v, w) for v in morse_graph.vertices() for w in morse_graph.adjacencies(v)]
+    for v, w in reduced_reachability_edges(morse_graph.vertices(), edges, set(non_trivial_nodes)):
+        non_trivial_cmg.add_edge(v, w)
     return non_trivial_cmg
 
 def NonTrivialCMGraphPyChomP(morse_graph):
-    # Make a pyChomP graph from morse_graph
-    G = CMGDB_utils.DirectedAcyclicGraph()
-    for v in morse_graph.vertices():
-        G.add_vertex(v)
-    for v in morse_graph.vertices():
-        for w in morse_graph.adjacencies(v):
-            G.add_edge(v, w)
     # Space dimension
     v = list(morse_graph.vertices())[0]
     label = morse_graph.vertex_label(v)
@@ -62,19 +65,10 @@ def NonTrivialCMGraphPyChomP(morse_graph):
     for v in non_trivial_nodes:
         label = morse_graph.vertex_label(v)
         non_trivial_cmg.add_vertex(v, label=label)
-    for v in non_trivial_nodes:
-        for w in G.descendants(v):
-            if (w in non_trivial_nodes) and (w != v):
-                non_trivial_cmg.add_edge(v, w)
-    # The labels are not preserved in the transitively reduced
-    # graph. So need to remove edges from original graph.
-    # Get transitively reduced graph and its edges
-    G_reduced = non_trivial_cmg.transitive_reduction()
-    edges_reduced = G_reduced.edges()
-    # Remove transitive reducible edges
-    for (v, w) in non_trivial_cmg.edges():
-        if (v, w) not in edges_reduced:
-            non_trivial_cmg.remove_edge(v, w)
+    # Add the edges of the transitive reduction of the order restricted to nontrivial nodes
+    edges = [(v, w) for v in morse_graph.vertices() for w in morse_graph.adjacencies(v)]
+    for v, w in reduced_reachability_edges(morse_graph.vertices(), edges, set(non_trivial_nodes)):
+        non_trivial_cmg.add_edge(v, w)
     return non_trivial_cmg
 
 def graph_from_dotfile(dot_fname):
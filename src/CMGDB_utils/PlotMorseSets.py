@@ -7,9 +7,73 @@ import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
 
+def morse_sets_array(morse_sets):
+    """Return the Morse sets boxes (rows min vertex + max vertex + Morse node) as an
+       (N, 2*dim + 1) array. An extra fake dimension is added if dim is 1."""
+    rects = np.asarray(morse_sets, dtype=float)
+    assert rects.ndim == 2 and rects.shape[1] % 2 == 1, "Wrong dimension in Morse sets data"
+    if rects.shape[1] == 3:
+        # Add extra fake dimension to plot
+        x1_max = rects[0, 1] - rects[0, 0]
+        rects = np.column_stack([rects[:, 0], np.zeros(len(rects)), rects[:, 1],
+                                 np.full(len(rects), x1_max), rects[:, 2]])
+    return rects
+
+def group_morse_sets(rects):
+    """Return a dictionary with the rows of rects of each Morse node"""
+    nodes = rects[:, -1].astype(np.int64)
+    order = np.argsort(nodes, kind='stable')
+    morse_nodes, starts = np.unique(nodes[order], return_index=True)
+    return dict(zip(morse_nodes.tolist(), np.split(rects[order], starts[1:])))
+
+def rasterize_rects(rects, d1, d2, priorities):
+    """Paint the projections onto the dimensions d1 and d2 of the rectangles of rects into
+       a 2D image with pixels of the size of the smallest rectangle. Each pixel gets the
+       largest priority of the rectangles covering it (or -1 if none). Return the image
+       (rows are y values) and its extent [x_min, x_max, y_min, y_max]."""
+    dim = (rects.shape[1] - 1) // 2
+    lower = rects[:, [d1, d2]]
+    upper = rects[:, [dim + d1, dim + d2]]
+    # Pixel size and image origin
+    pixel_size = np.min(upper - lower, axis=0)
+    pixel_size[pixel_size <= 0] = 1.0
+    origin = np.min(lower, axis=0)
+    lower_pixels = np.round((lower - origin) / pixel_size).astype(np.int64)
+    upper_pixels = np.maximum(np.round((upper - origin) / pixel_size).astype(np.int64), lower_pixels + 1)
+    spans = upper_pixels - lower_pixels
+    # Pixels covered by each rectangle (first dimension varies fastest)
+    num_pixels = spans[:, 0] * spans[:, 1]
+    rect_ids = np.repeat(np.arange(len(rects)), num_pixels)
+    positions = np.arange(np.sum(num_pixels)) - np.repeat(np.cumsum(num_pixels) - num_pixels, num_pixels)
+    x_pixels = lower_pixels[rect_ids, 0] + positions % spans[rect_ids, 0]
+    y_pixels = lower_pixels[rect_ids, 1] + positions // spans[rect_ids, 0]
+    width, height = np.max(upper_pixels, axis=0) if len(rects) else (0, 0)
+    image = np.full((height, width), -1, dtype=np.int64)
+    np.maximum.at(image, (y_pixels, x_pixels), np.asarray(priorities, dtype=np.int64)[rect_ids])
+    extent = [origin[0], origin[0] + width * pixel_size[0], origin[1], origin[1] + height * pixel_size[1]]
+    return image, extent
+
+def plot_rects_raster(ax, morse_sets, morse_nodes, d1, d2, node_color, priority=None):
+    """Plot the projections of the Morse sets (dictionary of rows of rectangles of each
+       Morse node) with a single imshow. Where projections overlap the Morse node coming
+       last in priority (morse_nodes if None) is shown. The Morse nodes not in priority
+       get the lowest priority."""
+    if priority is None:
+        priority = morse_nodes
+    priority = [node for node in morse_nodes if node not in priority] + list(priority)
+    priority = [node for node in priority if node in morse_nodes and node in morse_sets]
+    rects = np.vstack([morse_sets[node] for node in priority])
+    priorities = np.repeat(np.arange(len(priority)), [len(morse_sets[node]) for node in priority])
+    image, extent = rasterize_rects(rects, d1, d2, priorities)
+    # Colors of the image pixels (transparent if empty)
+    colors = np.array([matplotlib.colors.to_rgba(node_color(node)) for node in priority])
+    rgba_image = np.zeros(image.shape + (4,))
+    rgba_image[image >= 0] = colors[image[image >= 0]]
+    ax.imshow(rgba_image, origin='lower', extent=extent, interpolation='nearest', aspect='auto')
+
 def PlotMorseSets(morse_graph_data, cubical_complex=None, morse_nodes=None, proj_dims=None,
                   cmap=None, clist=None, fig_w=8, fig_h=8, xlim=None, ylim=None, axis_labels=True,
-                  xlabel='$x$', ylabel='$y$', fontsize=15, fig_fname=None, dpi=300):
+                  xlabel='$x$', ylabel='$y$', fontsize=15, fig_fname=None, dpi=300, raster=False, priority=None):
     # Default color list
     default_clist = ['#1f77b4', '#e6550d', '#31a354', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
                      '#bcbd22', '#80b1d3', '#ffffb3', '#fccde5', '#b3de69', '#fdae6b', '#6a3d9a', '#c49c94',
@@ -22,24 +86,31 @@ def PlotMorseSets(morse_graph_data, cubical_complex=None, morse_nodes=None, proj
         morse_sets = CMGDB_utils.LoadMorseSetFile(morse_fname)
         # Number of Morse sets
         num_morse_sets = max([int(rect[-1]) for rect in morse_sets]) + 1
-    else:
-        # Get Morse graph data components
+    elif not (isinstance(morse_graph_data, CMGDB_utils.MorseSetProjections) or
+              isinstance(cubical_complex, CMGDB_utils.CubicalGrid)):
+        # Get array of Morse sets boxes (for example of an adaptive grid)
         morse_graph, morse_decomp, vertex_mapping = morse_graph_data
         # Number of Morse sets
         num_morse_sets = len(morse_graph.vertices())
-        # Get list of Morse sets boxes
-        morse_sets = []
-        for n in range(num_morse_sets):
-            # Get corresponding Morse node
-            morse_node = vertex_mapping[n]
-            # Get cells in Morse decomposition node
-            morse_set = morse_decomp.morseset(n)
-            for index in morse_set:
-                # Get min and max vertices of cube
-                min_vert = cubical_complex.min_vertex(index)
-                max_vert = cubical_complex.max_vertex(index)
-                # Add Morse set box to list of Morse sets
-                morse_sets.append(min_vert + max_vert + [morse_node])
+        morse_sets = {vertex_mapping[n]: morse_decomp.morseset(n) for n in range(num_morse_sets)}
+        morse_sets = CMGDB_utils.morse_set_rects(cubical_complex, morse_sets)
+    else:
+        # Morse sets projections (can be given to reuse them across plots)
+        if isinstance(morse_graph_data, CMGDB_utils.MorseSetProjections):
+            projections = morse_graph_data
+        else:
+            projections = CMGDB_utils.MorseSetProjections.from_morse_graph_data(morse_graph_data, cubical_complex)
+        # Number of Morse sets
+        num_morse_sets = max(projections.morse_nodes) + 1
+        if projections.dim < 2:
+            # Get array of Morse sets boxes
+            morse_sets = projections.boxes()
+        else:
+            # Get array of distinct projected cells of the Morse sets
+            d1, d2 = (0, 1) if proj_dims == None else proj_dims
+            assert max(d1, d2) < projections.dim, "Wrong projection dimensions"
+            morse_sets = projections.rects(d1, d2)
+            proj_dims = [0, 1]
     # Set colormap for Morse sets
     if cmap == None and clist == None:
         clist = default_clist
@@ -59,16 +130,10 @@ def PlotMorseSets(morse_graph_data, cubical_complex=None, morse_nodes=None, proj
         cmap_norm = matplotlib.colors.Normalize(vmin=0, vmax=num_morse_sets-1)
     # # Default colormap
     # default_cmap = matplotlib.cm.tab20
-    rect = morse_sets[0]
-    assert len(rect) % 2 == 1, "Wrong dimension in Morse sets data"
-    dim = int((len(rect) - 1) / 2)
-    if dim == 1:
-        # Add extra fake dimension to plot
-        x0_min, x0_max, node = morse_sets[0]
-        x1_min = 0
-        x1_max = x0_max - x0_min
-        morse_sets = [[x0_min, x1_min, x0_max, x1_max, node] for x0_min, x0_max, node in morse_sets]
-        dim = 2
+    # Get array of Morse sets boxes grouped by Morse node
+    rects = morse_sets_array(morse_sets)
+    dim = (rects.shape[1] - 1) // 2
+    morse_sets = group_morse_sets(rects)
     if morse_nodes == None:
         morse_nodes = range(num_morse_sets)
     if proj_dims == None:
@@ -78,10 +143,12 @@ def PlotMorseSets(morse_graph_data, cubical_complex=None, morse_nodes=None, proj
         d1 = proj_dims[0]
         d2 = proj_dims[1]
     assert max(d1, d2) < dim, "Wrong projection dimensions"
+    # Boxes of the Morse nodes to plot
+    plot_rects = np.vstack([morse_sets[node] for node in morse_nodes if node in morse_sets])
     # Get min and max x and y values
     if xlim == None:
-        x_min = min([rect[d1] for rect in morse_sets if int(rect[-1]) in morse_nodes])
-        x_max = max([rect[dim + d1] for rect in morse_sets if int(rect[-1]) in morse_nodes])
+        x_min = np.min(plot_rects[:, d1])
+        x_max = np.max(plot_rects[:, dim + d1])
         if x_max - x_min < 0.1:
             x_min -= 0.05
             x_max += 0.05
@@ -89,8 +156,8 @@ def PlotMorseSets(morse_graph_data, cubical_complex=None, morse_nodes=None, proj
         x_min = xlim[0]
         x_max = xlim[1]
     if ylim == None:
-        y_min = min([rect[d2] for rect in morse_sets if int(rect[-1]) in morse_nodes])
-        y_max = max([rect[dim + d2] for rect in morse_sets if int(rect[-1]) in morse_nodes])
+        y_min = np.min(plot_rects[:, d2])
+        y_max = np.max(plot_rects[:, dim + d2])
         if y_max - y_min < 0.1:
             y_min -= 0.05
             y_max += 0.05
@@ -120,28 +187,33 @@ def PlotMorseSets(morse_graph_data, cubical_complex=None, morse_nodes=None, proj
     # M = ax.transData.get_matrix()
     # x_scale = M[0,0]
     # y_scale = M[1,1]
-    for morse_node in morse_nodes:
-        morse_set = [rect for rect in morse_sets if int(rect[-1]) == morse_node]
-        # Use morse_node as color index for consistency if not plotting all
-        clr = matplotlib.colors.to_hex(cmap(cmap_norm(morse_node)), keep_alpha=True)
-        X = []; Y = []; S = []
-        for rect in morse_set:
-            p1 = [rect[d1], rect[d2]]                   # Lower point
-            p2 = [rect[dim + d1], rect[dim + d2]]       # Upper point
-            p = list((np.array(p1) + np.array(p2)) / 2) # Center point
-            s = list((np.array(p2) - np.array(p1)))     # Rect size
-            s_x = (s0_x * s[0]) ** 2 # Scatter x-axis size
-            s_y = (s0_y * s[1]) ** 2 # Scatter y-axis size
+    # Use morse_node as color index for consistency if not plotting all
+    node_color = lambda morse_node: matplotlib.colors.to_hex(cmap(cmap_norm(morse_node)), keep_alpha=True)
+    if raster:
+        # Paint all Morse sets into a single image
+        plot_rects_raster(ax, morse_sets, list(morse_nodes), d1, d2, node_color, priority=priority)
+        ax.set_xlim([x_min, x_max])
+        ax.set_ylim([y_min, y_max])
+    else:
+        for morse_node in morse_nodes:
+            if morse_node not in morse_sets:
+                continue
+            morse_set = morse_sets[morse_node]
+            clr = node_color(morse_node)
+            p1 = morse_set[:, [d1, d2]]             # Lower points
+            p2 = morse_set[:, [dim + d1, dim + d2]] # Upper points
+            p = (p1 + p2) / 2 # Center points
+            s = p2 - p1       # Rect sizes
+            s_x = (s0_x * s[:, 0]) ** 2 # Scatter x-axis size
+            s_y = (s0_y * s[:, 1]) ** 2 # Scatter y-axis size
             # Alternative way to set marker size in data units
-            # s_x = (x_scale * s[0]) ** 2 # Scatter x-axis size
-            # s_y = (y_scale * s[1]) ** 2 # Scatter y-axis size
-            X.append(p[0])
-            Y.append(p[1])
+            # s_x = (x_scale * s[:, 0]) ** 2 # Scatter x-axis size
+            # s_y = (y_scale * s[:, 1]) ** 2 # Scatter y-axis size
             # Use max of both sizes
-            S.append(max(s_x, s_y))
-        ax.scatter(X, Y, s=S, marker='s', c=clr)
-        # ax.scatter(X, Y, s=S, marker='s', c=clr, edgecolors=None)
-        # ax.scatter(X, Y, s=S, marker='s', c=clr, alpha=0.5)
+            S = np.maximum(s_x, s_y)
+            ax.scatter(p[:, 0], p[:, 1], s=S, marker='s', c=clr)
+            # ax.scatter(X, Y, s=S, marker='s', c=clr, edgecolors=None)
+            # ax.scatter(X, Y, s=S, marker='s', c=clr, alpha=0.5)
     # Add axis labels
     if axis_labels:
         ax.set_xlabel(xlabel, fontsize=fontsize)
@@ -6,11 +6,12 @@
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
+import CMGDB_utils
 import CMGDB
 
 def PlotMorseSets_new(morse_sets, morse_nodes=None, proj_dims=None, cmap=None, clist=None,
                   scale_factor=None, fig_w=8, fig_h=8, xlim=None, ylim=None, axis_labels=True,
-                  xlabel='$x$', ylabel='$y$', fontsize=15, fig_fname=None, dpi=300):
+                  xlabel='$x$', ylabel='$y$', fontsize=15, fig_fname=None, dpi=300, raster=False, priority=None):
     # Check if morse_sets is a Morse graph, file name, or list
     if type(morse_sets) == CMGDB._cmgdb.MorseGraph: # Morse graph
         morse_graph = morse_sets
@@ -20,7 +21,7 @@ def PlotMorseSets_new(morse_sets, morse_nodes=None, proj_dims=None, cmap=None, c
         morse_sets = [box + [node] for node in morse_nodes for box in morse_graph.morse_set_boxes(node)]
     elif type(morse_sets) == str: # String representing file name
         morse_fname = morse_sets
-        morse_sets = CMGDB.LoadMorseSetFile(morse_fname)
+        morse_sets = CMGDB_utils.LoadMorseSetFile(morse_fname)
         num_morse_sets = None
     else: # List of Morse sets
         num_morse_sets = None
@@ -28,11 +29,11 @@ def PlotMorseSets_new(morse_sets, morse_nodes=None, proj_dims=None, cmap=None, c
     PlotBoxesScatter_new(morse_sets, num_morse_sets=num_morse_sets, morse_nodes=morse_nodes,
                      scale_factor=scale_factor, proj_dims=proj_dims, cmap=cmap, clist=clist, fig_w=fig_w, fig_h=fig_h,
                      xlim=xlim, ylim=ylim, axis_labels=axis_labels, xlabel=xlabel,
-                     ylabel=ylabel, fontsize=fontsize, fig_fname=fig_fname, dpi=dpi)
+                     ylabel=ylabel, fontsize=fontsize, fig_fname=fig_fname, dpi=dpi, raster=raster, priority=priority)
 
 def PlotBoxesScatter_new(morse_sets, num_morse_sets=None, morse_nodes=None, proj_dims=None, cmap=None,
                      scale_factor=None, clist=None, fig_w=8, fig_h=8, xlim=None, ylim=None, axis_labels=True,
-                     xlabel='$x$', ylabel='$y$', fontsize=15, fig_fname=None, dpi=300):
+                     xlabel='$x$', ylabel='$y$', fontsize=15, fig_fname=None, dpi=300, raster=False, priority=None):
     # Default color list
     default_clist = ['#1f77b4', '#e6550d', '#31a354', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
                      '#bcbd22', '#80b1d3', '#ffffb3', '#fccde5', '#b3de69', '#fdae6b', '#6a3d9a', '#c49c94',
@@ -41,18 +42,12 @@ def PlotBoxesScatter_new(morse_sets, num_morse_sets=None, morse_nodes=None, proj
                      '#e7969c', '#17becf', '#7b4173', '#8ca252', '#ad494a', '#8c6d31', '#a55194', '#00cc49']
     # # Default colormap
     # default_cmap = matplotlib.cm.tab20
-    rect = morse_sets[0]
-    assert len(rect) % 2 == 1, "Wrong dimension in Morse sets data"
-    dim = int((len(rect) - 1) / 2)
-    if dim == 1:
-        # Add extra fake dimension to plot
-        x0_min, x0_max, node = morse_sets[0]
-        x1_min = 0
-        x1_max = x0_max - x0_min
-        morse_sets = [[x0_min, x1_min, x0_max, x1_max, node] for x0_min, x0_max, node in morse_sets]
-        dim = 2
+    # Get array of Morse sets boxes grouped by Morse node
+    rects = CMGDB_utils.morse_sets_array(morse_sets)
+    dim = (rects.shape[1] - 1) // 2
+    morse_sets = CMGDB_utils.group_morse_sets(rects)
     if num_morse_sets == None:
-        num_morse_sets = max([int(rect[-1]) for rect in morse_sets]) + 1
+        num_morse_sets = max(morse_sets) + 1
     if morse_nodes == None:
         morse_nodes = range(num_morse_sets)
     if scale_factor == None:
@@ -81,10 +76,12 @@ def PlotBoxesScatter_new(morse_sets, num_morse_sets=None, morse_nodes=None, proj
         d1 = proj_dims[0]
         d2 = proj_dims[1]
     assert max(d1, d2) < dim, "Wrong projection dimensions"
+    # Boxes of the Morse nodes to plot
+    plot_rects = np.vstack([morse_sets[node] for node in morse_nodes if node in morse_sets])
     # Get min and max x and y values
     if xlim == None:
-        x_min = min([rect[d1] for rect in morse_sets if int(rect[-1]) in morse_nodes])
-        x_max = max([rect[dim + d1] for rect in morse_sets if int(rect[-1]) in morse_nodes])
+        x_min = np.min(plot_rects[:, d1])
+        x_max = np.max(plot_rects[:, dim + d1])
         if x_max - x_min < 0.1:
             x_min -= 0.05
             x_max += 0.05
@@ -92,8 +89,8 @@ def PlotBoxesScatter_new(morse_sets, num_morse_sets=None, morse_nodes=None, proj
         x_min = xlim[0]
         x_max = xlim[1]
     if ylim == None:
-        y_min = min([rect[d2] for rect in morse_sets if int(rect[-1]) in morse_nodes])
-        y_max = max([rect[dim + d2] for rect in morse_sets if int(rect[-1]) in morse_nodes])
+        y_min = np.min(plot_rects[:, d2])
+        y_max = np.max(plot_rects[:, dim + d2])
         if y_max - y_min < 0.1:
             y_min -= 0.05
             y_max += 0.05
@@ -123,28 +120,33 @@ def PlotBoxesScatter_new(morse_sets, num_morse_sets=None, morse_nodes=None, proj
     # M = ax.transData.get_matrix()
     # x_scale = M[0,0]
     # y_scale = M[1,1]
-    for morse_node in morse_nodes:
-        morse_set = [rect for rect in morse_sets if int(rect[-1]) == morse_node]
-        # Use morse_node as color index for consistency if not plotting all
-        clr = matplotlib.colors.to_hex(cmap(cmap_norm(morse_node)), keep_alpha=True)
-        X = []; Y = []; S = []
-        for rect in morse_set:
-            p1 = [rect[d1], rect[d2]]                   # Lower point
-            p2 = [rect[dim + d1], rect[dim + d2]]       # Upper point
-            p = list((np.array(p1) + np.array(p2)) / 2) # Center point
-            s = list((np.array(p2) - np.array(p1)))     # Rect size
-            s_x = (scale_factor[morse_node] * s0_x * s[0]) ** 2 # Scatter x-axis size
-            s_y = (scale_factor[morse_node] * s0_y * s[1]) ** 2 # Scatter y-axis size
+    # Use morse_node as color index for consistency if not plotting all
+    node_color = lambda morse_node: matplotlib.colors.to_hex(cmap(cmap_norm(morse_node)), keep_alpha=True)
+    if raster:
+        # Paint all Morse sets into a single image (scale_factor is not used)
+        CMGDB_utils.plot_rects_raster(ax, morse_sets, list(morse_nodes), d1, d2, node_color, priority=priority)
+        ax.set_xlim([x_min, x_max])
+        ax.set_ylim([y_min, y_max])
+    else:
+        for morse_node in morse_nodes:
+            if morse_node not in morse_sets:
+                continue
+            morse_set = morse_sets[morse_node]
+            clr = node_color(morse_node)
+            p1 = morse_set[:, [d1, d2]]             # Lower points
+            p2 = morse_set[:, [dim + d1, dim + d2]] # Upper points
+            p = (p1 + p2) / 2 # Center points
+            s = p2 - p1       # Rect sizes
+            s_x = (scale_factor[morse_node] * s0_x * s[:, 0]) ** 2 # Scatter x-axis size
+            s_y = (scale_factor[morse_node] * s0_y * s[:, 1]) ** 2 # Scatter y-axis size
             # Alternative way to set marker size in data units
-            # s_x = (x_scale * s[0]) ** 2 # Scatter x-axis size
-            # s_y = (y_scale * s[1]) ** 2 # Scatter y-axis size
-            X.append(p[0])
-            Y.append(p[1])
+            # s_x = (x_scale * s[:, 0]) ** 2 # Scatter x-axis size
+            # s_y = (y_scale * s[:, 1]) ** 2 # Scatter y-axis size
             # Use max of both sizes
-            S.append(max(s_x, s_y))
-        ax.scatter(X, Y, s=S, marker='s', c=clr)
-        # ax.scatter(X, Y, s=S, marker='s', c=clr, edgecolors=None)
-        # ax.scatter(X, Y, s=S, marker='s', c=clr, alpha=0.5)
+            S = np.maximum(s_x, s_y)
+            ax.scatter(p[:, 0], p[:, 1], s=S, marker='s', c=clr)
+            # ax.scatter(X, Y, s=S, marker='s', c=clr, edgecolors=None)
+            # ax.scatter(X, Y, s=S, marker='s', c=clr, alpha=0.5)
     # Add axis labels
     if axis_labels:
         ax.set_xlabel(xlabel, fontsize=fontsize)
@@ -3,9 +3,15 @@
 
 import CMGDB_utils
 
+import numpy as np
 import csv
+import os
 
 def SaveMorseSets(morse_graph_data, cubical_complex, morse_sets_fname):
+    # Save in binary format if file extension is .npz
+    if os.fspath(morse_sets_fname).endswith('.npz'):
+        SaveMorseSetIndices(morse_graph_data, cubical_complex, morse_sets_fname)
+        return
     # Get Morse graph data components
     morse_graph, morse_decomp, vertex_mapping = morse_graph_data
     # Number of Morse sets
@@ -26,9 +32,68 @@ def SaveMorseSets(morse_graph_data, cubical_complex, morse_sets_fname):
                 csv_writer.writerow(morse_rect)
 
 def LoadMorseSetFile(morse_sets_fname):
+    """Load the Morse sets boxes (rows min vertex + max vertex + Morse node) saved by
+       SaveMorseSets. The boxes are returned as a list of rows for a CSV file and as
+       an (N, 2*dim + 1) array for a .npz file."""
+    # Load from binary format if file extension is .npz
+    if os.fspath(morse_sets_fname).endswith('.npz'):
+        cubical_complex, morse_sets = LoadMorseSetIndices(morse_sets_fname)
+        return morse_set_rects(cubical_complex, morse_sets)
     morse_sets = []
     with open(morse_sets_fname, 'r') as csv_file:
         csv_reader = csv.reader(csv_file, quoting=csv.QUOTE_NONNUMERIC, skipinitialspace=True)
         for row in csv_reader:
             morse_sets.append(row)
     return morse_sets
+
+def SaveMorseSetIndices(morse_graph_data, cubical_complex, morse_sets_fname):
+    """Save the Morse sets as arrays of cube indices together with the grid bounds
+       and size in a .npz file. The indices of the cubes of Morse node k are
+       indices[offsets[k]:offsets[k + 1]]. Only available for a uniform CubicalGrid."""
+    # The cube indices of other complexes (adaptive grids) do not define the boxes
+    if not isinstance(cubical_complex, CMGDB_utils.CubicalGrid):
+        raise ValueError("The Morse set indices can only be saved for a CubicalGrid (use a CSV file instead)")
+    # Get Morse graph data components
+    morse_graph, morse_decomp, vertex_mapping = morse_graph_data
+    # Number of Morse sets
+    num_morse_sets = len(morse_graph.vertices())
+    # Get the Morse sets indexed by Morse node
+    morse_sets = [None] * num_morse_sets
+    for n in range(num_morse_sets):
+        morse_sets[vertex_mapping[n]] = np.asarray(morse_decomp.morseset(n), dtype=np.int64)
+    offsets = np.zeros(num_morse_sets + 1, dtype=np.int64)
+    np.cumsum([len(morse_set) for morse_set in morse_sets], out=offsets[1:])
+    indices = np.concatenate(morse_sets) if morse_sets else np.empty(0, dtype=np.int64)
+    # Store the indices with 32 bits if possible
+    if int(np.prod(cubical_complex.get_grid_size())) < 2**31:
+        indices = indices.astype(np.int32)
+    np.savez(morse_sets_fname, offsets=offsets, indices=indices,
+             lower_bounds=np.asarray(cubical_complex.get_lower_bounds(), dtype=float),
+             upper_bounds=np.asarray(cubical_complex.get_upper_bounds(), dtype=float),
+             grid_size=np.asarray(cubical_complex.get_grid_size(), dtype=np.int64))
+
+def LoadMorseSetIndices(morse_sets_fname):
+    """Load the Morse sets saved by SaveMorseSetIndices. Return the cubical complex
+       and a dictionary with the array of cube indices of each Morse node."""
+    with np.load(morse_sets_fname) as data:
+        offsets = data['offsets']
+        indices = data['indices']
+        lower_bounds = data['lower_bounds'].tolist()
+        upper_bounds = data['upper_bounds'].tolist()
+        grid_size = data['grid_size'].tolist()
+    cubical_complex = CMGDB_utils.CubicalGrid(lower_bounds, upper_bounds, grid_size)
+    morse_sets = {k: indices[offsets[k]:offsets[k + 1]] for k in range(len(offsets) - 1)}
+    return cubical_complex, morse_sets
+
+def morse_set_rects(cubical_complex, morse_sets, morse_nodes=None):
+    """Return an (N, 2*dim + 1) array with the rectangles (min vertex + max vertex +
+       Morse node) of the cubes in the Morse sets of morse_nodes (all if None)"""
+    if morse_nodes is None:
+        morse_nodes = sorted(morse_sets)
+    dim = cubical_complex.dimension()
+    rects = [np.empty((0, 2 * dim + 1))]
+    for morse_node in morse_nodes:
+        indices = morse_sets[morse_node]
+        boxes = cubical_complex.boxes(indices).reshape(-1, 2 * dim)
+        rects.append(np.hstack([boxes, np.full((len(indices), 1), morse_node)]))
+    return np.vstack(rects)
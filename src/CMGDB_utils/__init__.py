@@ -8,12 +8,14 @@ from CMGDB_utils.NonTrivialCMGraph import NonTrivialCMGraphPyChomP
 from CMGDB_utils.NonTrivialCMGraph import graph_from_dotfile
 
 from CMGDB_utils.CubicalGrid import *
+from CMGDB_utils.AdaptiveCubicalGrid import *
 from CMGDB_utils.ComputeMorseGraph import *
 from CMGDB_utils.Model import *
 from CMGDB_utils.BoxMap import *
 from CMGDB_utils.BoxMapData import *
 from CMGDB_utils.PlotMorseGraph import *
 from CMGDB_utils.PlotMorseSets import *
+from CMGDB_utils.MorseSetProjections import *
 from CMGDB_utils.DirectedAcyclicGraph import *
 from CMGDB_utils.LatticeAttractors import *
 from CMGDB_utils.PlotGraph import *
@@ -27,4 +29,6 @@ from CMGDB_utils.PlotMorseSets_new import *
 
 from CMGDB_utils.compute_morse_graph_from_mvm import *
 from CMGDB_utils.MarkovContraction import *
+from CMGDB_utils.MultivaluedMapCache import *
+from CMGDB_utils.ConleyIndexCache import *
 # __all__ = ['NonTrivialCMGraph', 'NonTrivialCMGraphPyChomP', 'graph_from_dotfile']
@@ -3,6 +3,9 @@
 
 import CMGDB_utils
 import collections
+import functools
+import numpy as np
+import os
 
 def attractor_max_node(v, attractor, morse_graph):
     """Check if v is a maximal node in attractor"""
@@ -28,25 +31,113 @@ def attractor_type(attractor, morse_graph):
     # Type 1 if downset of multiple nodes
     return 1
 
+def edge_array(edges):
+    """Return the edges of a multi-valued map as an (E, 2) integer array. The edges can
+       be given as an (E, 2) integer array, the path of a .npy file with such an array
+       (which is memory mapped) or an iterable of pairs (v1, v2)."""
+    if isinstance(edges, (str, os.PathLike)):
+        edges = np.load(edges, mmap_mode='r')
+    elif not isinstance(edges, np.ndarray):
+        edges = np.array(list(edges), dtype=np.int64)
+    if edges.size == 0:
+        edges = np.empty((0, 2), dtype=np.int64)
+    if edges.ndim != 2 or edges.shape[1] != 2 or not np.issubdtype(edges.dtype, np.integer):
+        raise ValueError("The edges must be an (E, 2) integer array")
+    return edges
+
+class MorseGraphMVM:
+    """Morse graph data of the multi-valued map given by the edges (see edge_array) on a
+       grid of size grid_size. The multi-valued map, Morse graph (with Conley indices), lattices
+       of attractors and repellers and the attractor and repeller cell sets are computed
+       when first needed and cached, so they are computed only once for a given list of
+       edges. An instance can be passed instead of the list of edges to the functions
+       in this module to reuse the cached results."""
+
+    def __init__(self, edges, grid_size):
+        self.edges = edge_array(edges)
+        self.grid_size = grid_size
+        self.dim = len(grid_size)
+        self.num_cells = int(np.prod(grid_size))
+        # Directional attractors (forward) and repellers (backward)
+        self.attractor_cells = {}
+
+    @functools.cached_property
+    def F(self):
+        """Multi-valued map as a dictionary of adjacency lists"""
+        # Group the targets by source keeping the order of the edges
+        order = np.argsort(self.edges[:, 0], kind='stable')
+        sources = self.edges[order, 0]
+        targets = self.edges[order, 1]
+        vertices, starts = np.unique(sources, return_index=True)
+        F = collections.defaultdict(list)
+        for v, adjacencies in zip(vertices.tolist(), np.split(targets, starts[1:])):
+            F[v] = adjacencies.tolist()
+        return F
+
+    @functools.cached_property
+    def mvm(self):
+        """Multi-valued map as a sparse (CSR) adjacency matrix"""
+        return CMGDB_utils.edges_to_matrix(self.edges[:, 0], self.edges[:, 1], self.num_cells)
+
+    @functools.cached_property
+    def cubical_complex(self):
+        """Cubical complex on the normalized domain (just used for plotting)"""
+        return CMGDB_utils.CubicalGrid([0.0]*self.dim, [1.0]*self.dim, self.grid_size)
+
+    @functools.cached_property
+    def morse_graph_data(self):
+        """Morse graph data (morse_graph, morse_decomp, vertex_mapping)"""
+        periodic = [False]*self.dim
+        return CMGDB_utils.conley_morse_graph_from_matrix(self.mvm, self.grid_size, periodic, acyclic_check=True)
+
+    @property
+    def morse_graph(self):
+        """Conley Morse graph"""
+        return self.morse_graph_data[0]
+
+    @functools.cached_property
+    def morse_sets(self):
+        """Dictionary of Morse sets indexed by Morse node"""
+        morse_graph, morse_decomp, vertex_mapping = self.morse_graph_data
+        return {vertex_mapping[n]: morse_decomp.morseset(n) for n in range(len(morse_graph.vertices()))}
+
+    @functools.cached_property
+    def lattice_attractors(self):
+        """Lattice of attractors"""
+        return CMGDB_utils.lattice_attractors(self.morse_graph)
+
+    @functools.cached_property
+    def lattice_repellers(self):
+        """Lattice of repellers"""
+        return CMGDB_utils.lattice_repellers(self.morse_graph)
+
+    def directional_attractors(self, forward=True):
+        """Return the list of attractors (forward == True) or repellers (forward == False)
+           as sets of cells, in the order of the vertices of the corresponding lattice"""
+        if forward not in self.attractor_cells:
+            if forward:
+                self.attractor_cells[forward] = directional_attractor_cells(
+                    self.mvm, self.lattice_attractors, self.morse_sets, self.num_cells)
+            else:
+                # Repellers are the attractors of the transpose of the multi-valued map
+                self.attractor_cells[forward] = directional_attractor_cells(
+                    self.mvm.T.tocsr(), self.lattice_repellers, self.morse_sets, self.num_cells)
+        return self.attractor_cells[forward]
+
+def mvm_session(edges, grid_size):
+    """Return edges if it is a MorseGraphMVM or a new MorseGraphMVM from the edges"""
+    if isinstance(edges, MorseGraphMVM):
+        return edges
+    return MorseGraphMVM(edges, grid_size)
+
 def morse_graph_from_edges(edges, grid_size):
     """Compute Morse graph from list of edges"""
-    # Define multi-valued map from list of edges
-    F = collections.defaultdict(list)
-    for v1, v2 in edges:
-        F[v1].append(v2)
-    # Create normalized domain (just used for plotting)
-    dim = len(grid_size)
-    lower_bounds = [0.0]*dim
-    upper_bounds = [1.0]*dim
-    # Define model and compute Conley Morse graph
-    model = CMGDB_utils.Model(lower_bounds, upper_bounds, grid_size, F, map_type='G')
-    morse_graph_data, cubical_complex = CMGDB_utils.ComputeConleyMorseGraph(model, acyclic_check=True)
-    morse_graph = morse_graph_data[0]
-    return morse_graph, F
+    session = mvm_session(edges, grid_size)
+    return session.morse_graph, session.F
 
 def morse_graph_from_mvm(edges, grid_size):
     """Compute Morse graph from list of edges (mvm)"""
-    morse_graph, F = morse_graph_from_edges(edges, grid_size)
+    morse_graph = mvm_session(edges, grid_size).morse_graph
     mg_vertices = sorted(morse_graph.vertices())
     mg_labels = [morse_graph.vertex_label(v) for v in mg_vertices]
     mg_edges = morse_graph.edges()
@@ -56,9 +147,10 @@ def morse_graph_from_mvm(edges, grid_size):
 
 def lattice_attractors_from_mvm(edges, grid_size):
     """Compute lattice of attractors from list of edges (mvm)"""
-    morse_graph, F = morse_graph_from_edges(edges, grid_size)
+    session = mvm_session(edges, grid_size)
+    morse_graph = session.morse_graph
     # Compute lattice of attractors
-    latt_attractors = CMGDB_utils.lattice_attractors(morse_graph)
+    latt_attractors = session.lattice_attractors
     att_vertices = sorted(latt_attractors.vertices())
     att_labels = [latt_attractors.vertex_label(v) for v in att_vertices]
     att_edges = latt_attractors.edges()
@@ -78,9 +170,8 @@ def lattice_attractors_from_mvm(edges, grid_size):
 
 def lattice_repellers_from_mvm(edges, grid_size):
     """Compute lattice of repellers from list of edges (mvm)"""
-    morse_graph, F = morse_graph_from_edges(edges, grid_size)
-    # Compute lattice of attractors
-    latt_repellers = CMGDB_utils.lattice_repellers(morse_graph)
+    # Compute lattice of repellers
+    latt_repellers = mvm_session(edges, grid_size).lattice_repellers
     rep_vertices = sorted(latt_repellers.vertices())
     rep_labels = [latt_repellers.vertex_label(v) for v in rep_vertices]
     rep_edges = latt_repellers.edges()
@@ -90,18 +181,8 @@ def lattice_repellers_from_mvm(edges, grid_size):
 
 def morse_graph_from_edges_new(edges, grid_size):
     """Compute Morse graph from list of edges"""
-    # Define multi-valued map from list of edges
-    F = collections.defaultdict(list)
-    for v1, v2 in edges:
-        F[v1].append(v2)
-    # Create normalized domain (just used for plotting)
-    dim = len(grid_size)
-    lower_bounds = [0.0]*dim
-    upper_bounds = [1.0]*dim
-    # Define model and compute Conley Morse graph
-    model = CMGDB_utils.Model(lower_bounds, upper_bounds, grid_size, F, map_type='G')
-    morse_graph_data, cubical_complex = CMGDB_utils.ComputeConleyMorseGraph(model, acyclic_check=True)
-    return morse_graph_data, cubical_complex
+    session = mvm_session(edges, grid_size)
+    return session.morse_graph_data, session.cubical_complex
 
 def get_attractor(morse_nodes, morse_sets, F):
     """Compute the attractor starting at the Morse nodes"""
@@ -128,50 +209,64 @@ def get_attractor(morse_nodes, morse_sets, F):
         processed.add(cell)
     return attractor
 
-def directional_attractors_from_mvm(edges, grid_size, forward=True):
-    """Compute list of directional attractors from list of edges (mvm).
-       If forward == True compute attractors. If False compute repellers."""
-    mg_data, cubical_complex = morse_graph_from_edges_new(edges, grid_size)
-    # Get Morse graph data components
-    morse_graph, morse_decomp, vertex_mapping = mg_data
-    # Get Morse sets
-    morse_sets = {}
-    for n in range(len(morse_graph.vertices())):
-        # Get corresponding Morse node
-        node = vertex_mapping[n]
-        # Get cells in Morse decomposition node
-        morse_sets[node] = morse_decomp.morseset(n)
-    # Compute lattice of attractors or repellers
-    # Define multi-valued map from list of edges
-    F = collections.defaultdict(list)
-    if forward:
-        # Compute lattice of forward attractors (attractors)
-        latt_attractors = CMGDB_utils.lattice_attractors(morse_graph)
-        # Compute the multi-valued map F
-        for v1, v2 in edges:
-            F[v1].append(v2)
-    else:
-        # Compute lattice of backward attractors (repellers)
-        latt_attractors = CMGDB_utils.lattice_repellers(morse_graph)
-        # Compute the transpose of the multi-valued map F
-        for v1, v2 in edges:
-            F[v2].append(v1)
-    # Compute list of attractors
-    attractors = []
+def forward_closure(mvm, seeds, visited):
+    """Mark in the boolean array visited all cells reachable from the cells in seeds
+       by the multi-valued map given by the sparse (CSR) adjacency matrix mvm. The
+       cells already marked as visited (and their images) are not processed again."""
+    seeds = np.asarray(seeds, dtype=np.int64)
+    frontier = np.unique(seeds[~visited[seeds]])
+    visited[frontier] = True
+    while frontier.size > 0:
+        # Gather the adjacencies of all cells in the frontier
+        starts = mvm.indptr[frontier]
+        lengths = mvm.indptr[frontier + 1] - starts
+        positions = np.arange(np.sum(lengths)) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        adjacencies = mvm.indices[positions]
+        # Next frontier are the cells not yet visited
+        frontier = np.unique(adjacencies[~visited[adjacencies]])
+        visited[frontier] = True
+    return visited
+
+def directional_attractor_cells(mvm, latt_attractors, morse_sets, num_cells):
+    """Compute the list of attractors of the multi-valued map given by the sparse (CSR)
+       adjacency matrix mvm as sets of cells, in the order of the vertices of the lattice
+       of attractors latt_attractors."""
+    # Get the Morse nodes of each attractor
+    att_nodes = {}
     for v in latt_attractors.vertices():
         # Lattice of attractors vertex label
         label = latt_attractors.vertex_label(v)
+        # List of Morse nodes that belong to the attractor
+        att_nodes[v] = frozenset(int(s.strip()) for s in label.strip('{}').split(',')) if label.strip('{} ') else frozenset()
+    # Compute the attractors by increasing size. The attractor of a set of Morse nodes
+    # is computed from the attractor with one Morse node less, so each cell is only
+    # processed once for each attractor size.
+    closures = {}
+    attractors = {}
+    for v in sorted(latt_attractors.vertices(), key=lambda v: len(att_nodes[v])):
+        nodes = att_nodes[v]
         # Check for empty attractor
-        if not label.strip('{} '):
+        if not nodes:
             # Add empty attractor
-            attractors.append([])
+            attractors[v] = []
+            closures[nodes] = np.zeros(num_cells, dtype=bool)
             continue
-        # List of Morse nodes that belong to the attractor
-        morse_nodes = [int(s.strip()) for s in label.strip('{}').split(',')]
-        # Get the attractor and append to list
-        attractor = get_attractor(morse_nodes, morse_sets, F)
-        attractors.append(attractor)
-    return attractors
+        # Find an attractor with one less Morse node
+        n = next(n for n in nodes if nodes - {n} in closures)
+        visited = closures[nodes - {n}].copy()
+        forward_closure(mvm, morse_sets[n], visited)
+        closures[nodes] = visited
+        # Only keep the attractors needed for the next size
+        for key in [key for key in closures if len(key) < len(nodes) - 1]:
+            del closures[key]
+        # Get the attractor as a set of cells
+        attractors[v] = set(np.flatnonzero(visited).tolist())
+    return [attractors[v] for v in latt_attractors.vertices()]
+
+def directional_attractors_from_mvm(edges, grid_size, forward=True):
+    """Compute list of directional attractors from list of edges (mvm).
+       If forward == True compute attractors. If False compute repellers."""
+    return mvm_session(edges, grid_size).directional_attractors(forward)
 
 def attractors_from_mvm(edges, grid_size):
     """Compute list of attractors from list of edges (mvm)"""
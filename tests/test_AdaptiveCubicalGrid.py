@@ -0,0 +1,50 @@
+### test_AdaptiveCubicalGrid.py
+### MIT LICENSE 2026 Marcio Gameiro
+
+import CMGDB_utils
+
+import numpy as np
+import tracemalloc
+
+def refine_at_point(grid, point, num_refinements):
+    """Subdivide num_refinements times the leaves containing point"""
+    point = np.asarray(point, dtype=float)
+    dim = grid.dimension()
+    for _ in range(num_refinements):
+        boxes = grid.boxes(np.arange(grid.size()))
+        grid.subdivide(np.flatnonzero(np.all((boxes[:, :dim] <= point) & (boxes[:, dim:] >= point), axis=1)))
+    return grid
+
+def brute_force_cover(grid, boxes):
+    """Return the list of arrays of leaves intersecting each box"""
+    dim = grid.dimension()
+    leaf_boxes = grid.boxes(np.arange(grid.size()))
+    return [np.flatnonzero(np.all((leaf_boxes[:, :dim] <= box[dim:]) & (leaf_boxes[:, dim:] >= box[:dim]), axis=1))
+            for box in boxes]
+
+def test_grid_cover_batch_brute_force():
+    rng = np.random.default_rng(0)
+    for dim, num_refinements in [(1, 6), (2, 5), (3, 3)]:
+        grid = CMGDB_utils.AdaptiveCubicalGrid([0.0] * dim, [1.0] * dim, [4] * dim)
+        refine_at_point(grid, [0.3] * dim, num_refinements)
+        # Random boxes (some outside the domain) and boxes with faces on the grid
+        lower = rng.uniform(-0.2, 1.1, (200, dim))
+        boxes = np.hstack([lower, lower + rng.uniform(0, 0.4, (200, dim))])
+        boxes[:20] = np.round(boxes[:20] * 32) / 32
+        offsets, indices = grid.grid_cover_batch(boxes)
+        covers = brute_force_cover(grid, boxes)
+        for k in range(len(boxes)):
+            assert np.array_equal(indices[offsets[k]:offsets[k + 1]], covers[k])
+
+def test_grid_cover_batch_memory():
+    # The finest level is a grid of 32768 x 32768 cubes but there are only 100 leaves
+    grid = CMGDB_utils.AdaptiveCubicalGrid([0.0, 0.0], [1.0, 1.0], [8, 8])
+    refine_at_point(grid, [0.3, 0.3], 12)
+    boxes = np.array([[0.0, 0.0, 1.0, 1.0], [0.25, 0.25, 0.35, 0.35]])
+    tracemalloc.start()
+    offsets, indices = grid.grid_cover_batch(boxes, padding=True)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert np.array_equal(indices[offsets[0]:offsets[1]], np.arange(grid.size()))
+    # The intermediate arrays are proportional to the leaves hit (not to the finest grid)
+    assert peak_memory < 1000 * grid.size() * grid.num_levels()